@@ -3,8 +3,9 @@ from django import forms
 from django.utils.translation import ugettext as _
 
 from micromanager.models import content_category_model_map
+from micromanager.themes import theme_registry
 
-import os, json
+import os
 
 """
     CMSTagObject is an object created from a template tag
@@ -181,16 +182,9 @@ class CMSObject(object):
 class Theme(object):
 
     def __init__(self, theme_name):
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        self.dir_path = os.path.join(dir_path, "themes", theme_name)
+        self.dir_path = theme_registry.get_theme_path(theme_name)
 
         if not os.path.isdir(self.dir_path):
             raise FileNotFoundError("The theme %s could not be found." % theme_name)
 
-        settings_file_path = os.path.join(self.dir_path, "settings.json")
-
-        if not os.path.isfile(settings_file_path):
-            raise FileNotFoundError("settings file for theme %s could not be found." % theme_name)
-
-        with open(settings_file_path, "r") as f:
-            self.settings = json.load(f)
+        self.settings = theme_registry.get_settings(theme_name)
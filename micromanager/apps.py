@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class MicroManagerConfig(AppConfig):
+    name = 'micromanager'
+    verbose_name = 'micromanager'
+
+    def ready(self):
+        from micromanager.signals import connect_signals
+        connect_signals()
+
+        # registers the system checks
+        from micromanager import checks
+
+        # compile the templates of all active themes when the worker boots
+        if getattr(settings, "MICROMANAGER_WARM_TEMPLATES", False):
+            from micromanager.loaders import warm_template_cache
+            warm_template_cache()
@@ -0,0 +1,148 @@
+"""
+    Shared cache helpers for micromanager
+
+    - the django cache configured in MICROMANAGER_CACHE (default: 'default') is used as the
+      communication channel between worker processes
+    - SharedVersion is a counter stored in that cache, it is bumped whenever the underlying data changes,
+      after the transaction changing it has been committed
+    - ProcessCache keeps data in the memory of the current process and drops it as soon as
+      the SharedVersion it is bound to has changed
+    - DatabaseVersion is a counter stored in a database row, for data which must be in sync with
+      committed transactions
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+
+import threading, time
+
+CACHE_ALIAS = getattr(settings, "MICROMANAGER_CACHE", "default")
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class SharedVersion(object):
+
+    def __init__(self, name, *scope):
+        parts = ["micromanager", "version", name] + [str(s) for s in scope]
+        self.key = ":".join(parts)
+
+    def get(self):
+        cache = get_cache()
+        version = cache.get(self.key)
+
+        if version is None:
+            # initialize with a timestamp: a counter that has been evicted from the cache
+            # never comes back with a value a worker has already seen
+            cache.add(self.key, _now_ms(), None)
+            version = cache.get(self.key)
+
+        return version
+
+    def bump(self):
+        cache = get_cache()
+        try:
+            return cache.incr(self.key)
+        except ValueError:
+            cache.add(self.key, _now_ms(), None)
+            return cache.get(self.key)
+
+    # other processes must not see the new version before the new data, they would cache the old data under it
+    def bump_on_commit(self):
+        transaction.on_commit(self.bump)
+
+
+"""
+    same interface as SharedVersion, the counter is an integer column of a model instance
+    - checking it is a single indexed lookup, bumping it is part of the transaction changing the data
+"""
+class DatabaseVersion(object):
+
+    def __init__(self, model, pk, field):
+        self.model = model
+        self.pk = pk
+        self.field = field
+
+    def get(self):
+        return self.model._default_manager.filter(pk=self.pk).values_list(self.field, flat=True).first()
+
+    def bump(self):
+        self.model._default_manager.filter(pk=self.pk).update(**{self.field : F(self.field) + 1})
+
+
+class ProcessCache(object):
+
+    def __init__(self, version):
+        self.version = version
+        self._lock = threading.Lock()
+        self._seen_version = None
+        self._data = {}
+
+    def _validate(self):
+        version = self.version.get()
+        if version != self._seen_version:
+            self._data = {}
+            self._seen_version = version
+
+    def get(self, key, loader):
+        with self._lock:
+            self._validate()
+            if key not in self._data:
+                self._data[key] = loader()
+            return self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self._seen_version = None
+
+
+"""
+    the resolution cache holds everything the middleware needs to resolve a request:
+    setup state, the CMS row and the language set of the CMS
+    it is invalidated by micromanager.signals
+"""
+resolution_cache = ProcessCache(SharedVersion("resolution"))
+
+
+"""
+    listings of template contents (get_content_by_type, get_template_content), one cache per CMS
+    invalidated by micromanager.signals when a TemplateContent, its locales or its types change
+"""
+_listing_caches = {}
+_listing_caches_lock = threading.Lock()
+
+def get_listing_cache(cms_id):
+    listing_cache = _listing_caches.get(cms_id, None)
+
+    if listing_cache is None:
+        with _listing_caches_lock:
+            listing_cache = _listing_caches.setdefault(cms_id, ProcessCache(SharedVersion("listing", cms_id)))
+
+    return listing_cache
+
+
+"""
+    global content (template_content is None) of a CMS, shown on every page, one cache per CMS
+    bound to CMS.global_content_version, which micromanager.signals bumps when global content changes
+"""
+_global_content_caches = {}
+_global_content_caches_lock = threading.Lock()
+
+def get_global_content_cache(cms_id):
+    global_content_cache = _global_content_caches.get(cms_id, None)
+
+    if global_content_cache is None:
+        from micromanager.models import CMS
+        with _global_content_caches_lock:
+            global_content_cache = _global_content_caches.setdefault(
+                cms_id, ProcessCache(DatabaseVersion(CMS, cms_id, "global_content_version")))
+
+    return global_content_cache
@@ -0,0 +1,49 @@
+"""
+    system checks
+    - the version counters of micromanager.cache must be shared by all worker processes, a cache backend
+      which keeps its data in the memory of one process never tells the other processes about changes
+"""
+from django.conf import settings
+from django.core import checks
+
+from micromanager.cache import CACHE_ALIAS
+
+# backends which do not share their data between processes
+PER_PROCESS_BACKENDS = [
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+]
+
+
+@checks.register()
+def check_cache(app_configs, **kwargs):
+    errors = []
+
+    caches = getattr(settings, "CACHES", {})
+
+    if CACHE_ALIAS not in caches:
+        errors.append(checks.Error(
+            "MICROMANAGER_CACHE '%s' is not configured in CACHES." % CACHE_ALIAS,
+            id="micromanager.E001",
+        ))
+        return errors
+
+    backend = caches[CACHE_ALIAS].get("BACKEND", None)
+
+    if backend == "django.core.cache.backends.dummy.DummyCache":
+        errors.append(checks.Error(
+            "MICROMANAGER_CACHE '%s' uses the DummyCache, cached content would never be invalidated." % CACHE_ALIAS,
+            hint="Use a cache shared by all processes, e.g. memcached, redis or the database cache.",
+            id="micromanager.E002",
+        ))
+
+    elif backend in PER_PROCESS_BACKENDS:
+        errors.append(checks.Warning(
+            "MICROMANAGER_CACHE '%s' uses %s, which is local to each process. Changes made in one worker "
+            "process are not seen by the others." % (CACHE_ALIAS, backend.split(".")[-1]),
+            hint="Use a cache shared by all processes, e.g. memcached, redis or the database cache, "
+                 "unless the site is served by a single process.",
+            id="micromanager.W001",
+        ))
+
+    return errors
@@ -0,0 +1,294 @@
+"""
+    Translation completeness
+    - a template content is complete in a language if its LocalizedTemplateContent is ready for translation,
+      belongs to the current draft_version and all required (not optional) cms tags of its template have content
+    - the cms tags are read from the theme manifest (see micromanager.manifest), templates are not parsed
+    - completeness of many template contents is computed with one query for the localized template contents
+      and one or two per content model, independent of the number of template contents and languages
+
+    Translation status
+    - the result is stored per LocalizedTemplateContent in TranslationStatus: slots required and filled,
+      ready and dirty (draft not published)
+    - saving or deleting content, locales or the template content updates the status of its template content
+      in the same transaction, defer_translation_status() collects the updates of a form save and runs
+      them once at the end
+    - readers (the admin list, publishing) read the stored status, missing rows are computed and stored,
+      ``manage.py micromanager_rebuild_translation_status`` computes all rows from scratch
+    - the slots required by a template change with the template: when a manifest is rebuilt, the status of
+      the template contents whose templates have other slots than before is recomputed
+    - prefetch_translation_status() attaches the result to template contents, e.g. for the admin list,
+      TemplateContent.get_localized() and translation_complete() then run no queries
+"""
+from django.db import transaction, IntegrityError, DatabaseError
+
+from micromanager.models import (TemplateContent, LocalizedTemplateContent, MicroContent, LocalizedMicroContent,
+                                 TranslationStatus)
+
+from collections import OrderedDict
+import threading, logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 200
+
+
+"""
+    {template_content_id : (slots required, {language : slots filled})}
+"""
+def get_slot_counts_bulk(cms, template_contents):
+    from micromanager.manifest import get_cms_tags
+
+    template_contents = list(template_contents)
+    template_content_ids = [tc.pk for tc in template_contents]
+
+    languages = [language for language, is_primary in cms.language_set()]
+
+    required_tags = {}
+    filled_slots = {}
+
+    for tc in template_contents:
+        required_tags[tc.pk] = [tag for tag in get_cms_tags(cms.theme, tc.template_name) if not "optional" in tag.args]
+        filled_slots[tc.pk] = dict((language, 0) for language in languages)
+
+    Models = set([tag.Model for tags in required_tags.values() for tag in tags])
+
+    for Model in Models:
+        content_types = set([tag.content_type for tags in required_tags.values() for tag in tags if tag.Model == Model])
+
+        # (template_content_id, content_type) -> first instance, as Model.objects.filter(...).first() would return it
+        first_instances = {}
+        for instance in Model.objects.filter(template_content_id__in=template_content_ids,
+                                             content_type__in=content_types).order_by("pk"):
+            first_instances.setdefault((instance.template_content_id, instance.content_type), instance)
+
+        filled = None
+        if Model == MicroContent:
+            # a microcontent is complete in a language if its draft is not empty
+            filled = set(LocalizedMicroContent.objects.filter(
+                microcontent__in=[instance.pk for instance in first_instances.values()],
+                language__in=languages, draft_content__isnull=False).exclude(draft_content="").values_list(
+                "microcontent_id", "language"))
+
+        for tc in template_contents:
+            for tag in required_tags[tc.pk]:
+                if tag.Model != Model:
+                    continue
+
+                instance = first_instances.get((tc.pk, tag.content_type), None)
+
+                if instance is None:
+                    continue
+
+                for language in languages:
+                    if filled is not None:
+                        if (instance.pk, language) in filled:
+                            filled_slots[tc.pk][language] += 1
+                    elif instance.translation_complete(language, tag):
+                        filled_slots[tc.pk][language] += 1
+
+    return dict((tc.pk, (len(required_tags[tc.pk]), filled_slots[tc.pk])) for tc in template_contents)
+
+
+def _is_ready(template_content, ltc):
+    return ltc.translation_ready and ltc.draft_version == template_content.draft_version
+
+
+# as shown in the admin: not published or new changes
+def _is_dirty(template_content, ltc):
+    return ltc.published_version is None or ltc.draft_version != template_content.published_version
+
+
+"""
+    stored status
+"""
+def update_translation_status(cms, template_contents):
+    template_contents = list(template_contents)
+
+    if not template_contents:
+        return {}
+
+    template_contents_by_id = dict((tc.pk, tc) for tc in template_contents)
+
+    localized_template_contents = list(LocalizedTemplateContent.objects.filter(
+        template_content_id__in=list(template_contents_by_id.keys())))
+
+    slot_counts = get_slot_counts_bulk(cms, template_contents)
+
+    stored = dict((status.localized_template_content_id, status) for status in TranslationStatus.objects.filter(
+        localized_template_content__in=localized_template_contents))
+
+    statuses = {}
+    created = []
+
+    for ltc in localized_template_contents:
+        tc = template_contents_by_id[ltc.template_content_id]
+        required, filled = slot_counts[tc.pk]
+
+        values = {
+            "slots_required" : required,
+            # languages which are not supported by the cms (anymore) have no filled slots
+            "slots_filled" : filled.get(ltc.language, 0),
+            "ready" : _is_ready(tc, ltc),
+            "dirty" : _is_dirty(tc, ltc),
+        }
+
+        status = stored.get(ltc.pk, None)
+
+        if status is None:
+            status = TranslationStatus(localized_template_content=ltc, **values)
+            created.append(status)
+
+        elif any([getattr(status, field) != value for field, value in values.items()]):
+            for field, value in values.items():
+                setattr(status, field, value)
+            status.save(update_fields=list(values.keys()))
+
+        statuses[ltc.pk] = status
+
+    if created:
+        try:
+            with transaction.atomic():
+                TranslationStatus.objects.bulk_create(created)
+        except IntegrityError:
+            # computed by another process at the same time
+            pass
+
+    return statuses
+
+
+# {ltc_id : TranslationStatus}, missing rows are computed and stored
+def get_translation_status(cms, template_contents, localized_template_contents):
+    localized_template_contents = list(localized_template_contents)
+
+    statuses = dict((status.localized_template_content_id, status) for status in TranslationStatus.objects.filter(
+        localized_template_content__in=localized_template_contents))
+
+    missing = set([ltc.template_content_id for ltc in localized_template_contents if ltc.pk not in statuses])
+
+    if missing:
+        statuses.update(update_translation_status(cms, [tc for tc in template_contents if tc.pk in missing]))
+
+    return statuses
+
+
+"""
+    {template_content_id : set of incomplete languages}, read from the stored status
+"""
+def get_incomplete_languages_stored(cms, template_contents, localized_template_contents=None):
+
+    template_contents = list(template_contents)
+
+    languages = [language for language, is_primary in cms.language_set()]
+
+    if localized_template_contents is None:
+        localized_template_contents = LocalizedTemplateContent.objects.filter(
+            template_content_id__in=[tc.pk for tc in template_contents])
+
+    localized_template_contents = list(localized_template_contents)
+
+    statuses = get_translation_status(cms, template_contents, localized_template_contents)
+
+    locales = dict(((ltc.template_content_id, ltc.language), ltc) for ltc in localized_template_contents)
+
+    incomplete = dict((tc.pk, set([])) for tc in template_contents)
+
+    for tc in template_contents:
+        for language in languages:
+            ltc = locales.get((tc.pk, language), None)
+            if ltc is None or not statuses[ltc.pk].complete:
+                incomplete[tc.pk].add(language)
+
+    return incomplete
+
+
+def get_incomplete_languages(template_content, localized_template_contents=None):
+    return get_incomplete_languages_stored(template_content.cms, [template_content],
+                                           localized_template_contents)[template_content.pk]
+
+
+def prefetch_translation_status(cms, template_contents):
+    template_contents = list(template_contents)
+
+    localized_template_contents = list(LocalizedTemplateContent.objects.filter(
+        template_content_id__in=[template_content.pk for template_content in template_contents]).order_by("pk"))
+
+    incomplete = get_incomplete_languages_stored(cms, template_contents, localized_template_contents)
+
+    locales = {}
+    for ltc in localized_template_contents:
+        # the first one, as get_localized() would return it
+        locales.setdefault(ltc.template_content_id, {}).setdefault(ltc.language, ltc)
+
+    for template_content in template_contents:
+        template_content._prefetched_locales = locales.get(template_content.pk, {})
+        template_content._incomplete_languages = incomplete[template_content.pk]
+
+    return template_contents
+
+
+"""
+    updates on write, called by the signal handlers in micromanager.signals
+"""
+_deferred = threading.local()
+
+
+def _update_template_contents(template_content_ids):
+    template_contents = TemplateContent.objects.filter(pk__in=list(template_content_ids)).select_related("cms")
+
+    template_contents_by_cms = OrderedDict()
+    for template_content in template_contents:
+        template_contents_by_cms.setdefault(template_content.cms_id, []).append(template_content)
+
+    for cms_template_contents in template_contents_by_cms.values():
+        update_translation_status(cms_template_contents[0].cms, cms_template_contents)
+
+
+def translation_status_changed(template_content_id):
+    pending = getattr(_deferred, "template_content_ids", None)
+
+    if pending is not None:
+        pending.add(template_content_id)
+    else:
+        _update_template_contents([template_content_id])
+
+
+class defer_translation_status(object):
+
+    def __enter__(self):
+        self.outermost = getattr(_deferred, "template_content_ids", None) is None
+        if self.outermost:
+            _deferred.template_content_ids = set([])
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outermost:
+            template_content_ids = _deferred.template_content_ids
+            _deferred.template_content_ids = None
+
+            if exc_type is None and template_content_ids:
+                _update_template_contents(template_content_ids)
+
+
+"""
+    called by micromanager.manifest after the manifest of a theme has been rebuilt
+    - template_names are the templates whose slots have changed, None if all may have changed
+"""
+def template_slots_changed(theme_name, template_names=None):
+    template_contents = TemplateContent.objects.filter(cms__theme=theme_name).select_related("cms").order_by("pk")
+
+    if template_names is not None:
+        template_contents = template_contents.filter(template_name__in=list(template_names))
+
+    try:
+        with transaction.atomic():
+            template_contents_by_cms = OrderedDict()
+            for template_content in template_contents:
+                template_contents_by_cms.setdefault(template_content.cms_id, []).append(template_content)
+
+            for cms_template_contents in template_contents_by_cms.values():
+                for start in range(0, len(cms_template_contents), CHUNK_SIZE):
+                    update_translation_status(cms_template_contents[0].cms,
+                                              cms_template_contents[start:start + CHUNK_SIZE])
+    except DatabaseError:
+        # e.g. the tables do not exist yet, missing rows are computed when they are needed
+        logger.exception("updating the translation status of theme %s failed" % theme_name)
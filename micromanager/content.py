@@ -0,0 +1,323 @@
+"""
+    ContentBundle
+    - all MicroContent (with the LocalizedMicroContent of the requested language) and ContentImages
+      of one template_content plus the global content of its CMS
+    - loaded on first access, one category at a time: 2 queries for microcontent, 1 query for images
+    - bundles live on the request, every {% cms_get_* %} tag of a page reads from the same bundle
+    - rows are kept in pk order, the first row of a content_type is the one a .first() query would return
+
+    PublishedBundle
+    - public requests (no preview) read from PublishedContent instead: one document per page and language,
+      fetched with one query
+    - the global content is kept in a process cache per CMS and language, a request only reads
+      CMS.global_content_version to check it (see micromanager.cache.get_global_content_cache)
+    - a document holds only what the tags show: the published content of the page, the draft content of
+      the global content, no drafts of the page and no plain text
+    - page documents are written by the publishing pipeline, global documents are deleted when global
+      content changes; missing documents are built from the content tables on first access
+
+    listings
+    - list_content_by_type and list_template_content fetch the localized template contents and their
+      template contents in one ordered query, the limit is applied in SQL
+    - the results are cached per (cms, content_type/template_name, language, preview, limit) in the
+      listing cache of the CMS
+"""
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+
+from micromanager.models import (MicroContent, LocalizedMicroContent, ContentImages, LocalizedTemplateContent,
+                                 PublishedContent)
+from micromanager.cache import get_listing_cache, get_global_content_cache
+
+import json
+
+
+class ContentBundle(object):
+
+    def __init__(self, cms, template_content, language):
+        self.cms = cms
+        self.template_content = template_content
+        self.language = language
+        # content_category -> {content_type : [instances]}
+        self._contents = {}
+
+    def _get_queryset(self, Model):
+        template_content_id = getattr(self.template_content, "pk", None)
+
+        global_content = Q(cms=self.cms, template_content__isnull=True)
+
+        if template_content_id is None:
+            return Model.objects.filter(global_content)
+
+        return Model.objects.filter(Q(template_content_id=template_content_id) | global_content)
+
+    def _load_microcontents(self):
+        microcontents = list(self._get_queryset(MicroContent).order_by("pk"))
+
+        localized = {}
+        if microcontents:
+            lmcs = LocalizedMicroContent.objects.filter(microcontent__in=[mc.pk for mc in microcontents],
+                                                        language=self.language)
+            for lmc in lmcs:
+                localized[lmc.microcontent_id] = lmc
+
+        for microcontent in microcontents:
+            microcontent._prefetched_localized = {
+                self.language : localized.get(microcontent.pk, None),
+            }
+
+        return microcontents
+
+    def _load_images(self):
+        return list(self._get_queryset(ContentImages).order_by("pk"))
+
+    def _get_contents(self, Model):
+        if Model not in self._contents:
+
+            if Model == MicroContent:
+                instances = self._load_microcontents()
+            else:
+                instances = self._load_images()
+
+            contents = {}
+            for instance in instances:
+                contents.setdefault(instance.content_type, []).append(instance)
+
+            self._contents[Model] = contents
+
+        return self._contents[Model]
+
+    # the first instance of the page or the global content
+    def get_instance(self, Model, content_type):
+        instances = self._get_contents(Model).get(content_type, [])
+
+        if instances:
+            return instances[0]
+
+        return None
+
+    # all instances of the page, global content is not included
+    def get_instances(self, Model, content_type):
+        template_content_id = getattr(self.template_content, "pk", None)
+
+        return [instance for instance in self._get_contents(Model).get(content_type, [])
+                if instance.template_content_id is not None and instance.template_content_id == template_content_id]
+
+
+"""
+    {language : document} of a page or, if template_content is None, of the global content of the cms
+    - the document stores the values get_content() returns: the published content of a page,
+      the draft content of global content
+    - rows are in pk order like in ContentBundle
+"""
+def build_published_documents(cms, template_content, languages):
+    template_content_id = getattr(template_content, "pk", None)
+
+    if template_content_id is None:
+        filters = {"cms" : cms, "template_content__isnull" : True}
+        field = "draft_content"
+    else:
+        filters = {"template_content_id" : template_content_id}
+        field = "published_content"
+
+    microcontents = list(MicroContent.objects.filter(**filters).order_by("pk").values_list("pk", "content_type"))
+
+    localized = {}
+    if microcontents:
+        for microcontent_id, language, content in LocalizedMicroContent.objects.filter(
+                microcontent__in=[pk for pk, content_type in microcontents], language__in=languages).order_by(
+                "pk").values_list("microcontent_id", "language", field):
+            localized.setdefault((microcontent_id, language), content)
+
+    images = [[pk, content_type, name or None] for pk, content_type, name in ContentImages.objects.filter(
+                **filters).order_by("pk").values_list("pk", "content_type", field)]
+
+    documents = {}
+    for language in languages:
+        documents[language] = {
+            # [pk, content_type, has a localized microcontent, content]
+            "microcontent" : [[pk, content_type, (pk, language) in localized, localized.get((pk, language), None)]
+                              for pk, content_type in microcontents],
+            # [pk, content_type, file name]
+            "images" : images,
+        }
+
+    return documents
+
+
+def write_published_content(cms, template_content, languages):
+    documents = build_published_documents(cms, template_content, languages)
+
+    if template_content is None:
+        existing = PublishedContent.objects.filter(cms=cms, template_content__isnull=True)
+    else:
+        existing = PublishedContent.objects.filter(template_content=template_content)
+
+    with transaction.atomic():
+        existing.filter(language__in=languages).delete()
+        PublishedContent.objects.bulk_create([
+            PublishedContent(cms=cms, template_content=template_content, language=language,
+                             document=json.dumps(document))
+            for language, document in documents.items()
+        ])
+
+    return documents
+
+
+# the global documents are rebuilt on first access
+def invalidate_global_published_content(cms_id):
+    PublishedContent.objects.filter(cms_id=cms_id, template_content__isnull=True).delete()
+
+
+def delete_published_content(template_content):
+    PublishedContent.objects.filter(template_content=template_content).delete()
+
+
+def _load_document(cms, template_content, language):
+    if template_content is None:
+        published_content = PublishedContent.objects.filter(cms=cms, template_content__isnull=True,
+                                                            language=language).order_by("pk").first()
+    else:
+        published_content = PublishedContent.objects.filter(template_content=template_content,
+                                                            language=language).order_by("pk").first()
+
+    if published_content is not None:
+        return published_content.get_document()
+
+    try:
+        with transaction.atomic():
+            return write_published_content(cms, template_content, [language])[language]
+    except IntegrityError:
+        # written by a concurrent request, the content tables have the same values
+        return build_published_documents(cms, template_content, [language])[language]
+
+
+# {Model : [instances]} in pk order, instances are unsaved model instances built from the document
+def _build_instances(cms, template_content_id, language, document):
+    microcontents = []
+    images = []
+
+    for pk, content_type, has_localized, content in document["microcontent"]:
+        microcontent = MicroContent(pk=pk, cms_id=cms.pk, template_content_id=template_content_id,
+                                    content_type=content_type)
+        lmc = None
+        if has_localized:
+            lmc = LocalizedMicroContent(microcontent_id=pk, language=language, draft_content=content,
+                                        published_content=content)
+        microcontent._prefetched_localized = {language : lmc}
+        microcontents.append(microcontent)
+
+    for pk, content_type, name in document["images"]:
+        images.append(ContentImages(pk=pk, cms_id=cms.pk, template_content_id=template_content_id,
+                                    content_type=content_type, draft_content=name, published_content=name))
+
+    return {MicroContent : microcontents, ContentImages : images}
+
+
+"""
+    the global content of a cms in one language, built once per process and CMS.global_content_version
+    - the instances are shared by all requests and must not be changed
+    - the version is checked once per request
+"""
+def get_global_contents(request, language):
+    global_contents = getattr(request, "_micromanager_global_contents", None)
+
+    if global_contents is None:
+        global_contents = {}
+        request._micromanager_global_contents = global_contents
+
+    if language not in global_contents:
+        cms = request.cms
+
+        def load():
+            return _build_instances(cms, None, language, _load_document(cms, None, language))
+
+        global_contents[language] = get_global_content_cache(cms.pk).get(language, load)
+
+    return global_contents[language]
+
+
+"""
+    the same interface as ContentBundle for public requests
+    - the page is read from its PublishedContent document, the global content from the process cache
+"""
+class PublishedBundle(ContentBundle):
+
+    def __init__(self, cms, template_content, language, global_contents):
+        super(PublishedBundle, self).__init__(cms, template_content, language)
+        self.global_contents = global_contents
+
+    def _get_contents(self, Model):
+        if not self._contents:
+
+            instances = {MicroContent : [], ContentImages : []}
+
+            if self.template_content is not None:
+                document = _load_document(self.cms, self.template_content, self.language)
+                instances = _build_instances(self.cms, self.template_content.pk, self.language, document)
+
+            for Model_ in instances.keys():
+                # pk order across page and global content, as in ContentBundle
+                model_instances = sorted(instances[Model_] + self.global_contents[Model_],
+                                         key=lambda instance: instance.pk)
+                contents = {}
+                for instance in model_instances:
+                    contents.setdefault(instance.content_type, []).append(instance)
+                self._contents[Model_] = contents
+
+        return self._contents[Model]
+
+
+def get_content_bundle(request, template_content, language):
+    bundles = getattr(request, "_micromanager_content_bundles", None)
+
+    if bundles is None:
+        bundles = {}
+        request._micromanager_content_bundles = bundles
+
+    key = (getattr(template_content, "pk", None), language)
+
+    if key not in bundles:
+        if "preview" in request.GET:
+            bundles[key] = ContentBundle(request.cms, template_content, language)
+        else:
+            bundles[key] = PublishedBundle(request.cms, template_content, language,
+                                           get_global_contents(request, language))
+
+    return bundles[key]
+
+
+def _limit(queryset, limit):
+    if limit is not None:
+        queryset = queryset[:int(limit)]
+    return list(queryset)
+
+
+def list_content_by_type(cms, content_type, language, preview=False, limit=None):
+
+    def load():
+        localized_tcs = LocalizedTemplateContent.objects.filter(
+            template_content__cms=cms, language=language,
+            template_content__templatecontenttypes__content_type=content_type,
+            template_content__published_at__isnull=preview,
+        ).select_related("template_content").order_by("template_content__templatecontenttypes__position",
+                                                      "template_content_id")
+
+        return _limit(localized_tcs, limit)
+
+    key = ("content_type", content_type, language, preview, limit)
+    return list(get_listing_cache(cms.pk).get(key, load))
+
+
+def list_template_content(cms, template_name, language, preview=False, limit=None):
+
+    def load():
+        localized_tcs = LocalizedTemplateContent.objects.filter(
+            template_content__cms=cms, language=language, template_content__template_name=template_name,
+            template_content__published_at__isnull=preview,
+        ).select_related("template_content").order_by("-template_content__published_at", "-template_content_id")
+
+        return _limit(localized_tcs, limit)
+
+    key = ("template_name", template_name, language, preview, limit)
+    return list(get_listing_cache(cms.pk).get(key, load))
@@ -0,0 +1,133 @@
+"""
+    Dependency index
+    - while a public page is rendered, the template tags collect surrogate keys on the request
+      (see micromanager.surrogate): the page itself, included template contents, listings by content type
+      or template name, global content slots
+    - MicroManagerMiddleware records the keys of every public page in PageDependency, one row per (cms, path, key)
+    - only canonical paths are recorded: the page routes match any suffix (/pages/home/<anything>), a path
+      which does not reverse to itself from its resolver match is not recorded
+    - rows are only written if the keys of a page differ from what this process has recorded before,
+      rendering a known page does not touch the database
+    - query API for cache layers: which pages depend on a template content, a content type,
+      a template or a global slot
+"""
+from django.db import transaction, IntegrityError
+try:
+    from django.urls import reverse, NoReverseMatch
+except:
+    from django.core.urlresolvers import reverse, NoReverseMatch
+
+from micromanager.models import PageDependency
+from micromanager.surrogate import (page_key, content_type_key, template_key, global_key, global_slot_key,
+                                    get_template_content_keys)
+
+import threading
+
+
+PATH_MAX_LENGTH = PageDependency._meta.get_field("path").max_length
+
+
+# the path of the page as reversed from its url pattern, None if the request path is not canonical
+def get_canonical_path(request):
+    resolver_match = getattr(request, "resolver_match", None)
+
+    if resolver_match is None or resolver_match.view_name is None:
+        return None
+
+    try:
+        path = reverse(resolver_match.view_name, args=resolver_match.args, kwargs=resolver_match.kwargs)
+    except NoReverseMatch:
+        return None
+
+    if path != request.path or len(path) > PATH_MAX_LENGTH:
+        return None
+
+    return path
+
+
+class DependencyIndex(object):
+
+    def __init__(self):
+        # (cms_id, path) -> frozenset of keys, as recorded by this process
+        self._recorded = {}
+        self._lock = threading.Lock()
+
+    def record(self, cms_id, path, keys):
+        keys = frozenset(keys)
+
+        if self._recorded.get((cms_id, path), None) == keys:
+            return False
+
+        try:
+            with transaction.atomic():
+                stored = set(PageDependency.objects.filter(cms_id=cms_id, path=path).values_list("key", flat=True))
+
+                removed = stored - keys
+                if removed:
+                    PageDependency.objects.filter(cms_id=cms_id, path=path, key__in=removed).delete()
+
+                PageDependency.objects.bulk_create([PageDependency(cms_id=cms_id, path=path, key=key)
+                                                    for key in sorted(keys - stored)])
+        except IntegrityError:
+            # another process recorded the same page concurrently
+            return False
+
+        with self._lock:
+            self._recorded[(cms_id, path)] = keys
+
+        return True
+
+    def forget(self, cms_id, path):
+        PageDependency.objects.filter(cms_id=cms_id, path=path).delete()
+
+        with self._lock:
+            self._recorded.pop((cms_id, path), None)
+
+    # paths of all pages depending on at least one of the keys
+    def get_pages(self, cms_id, keys):
+        return sorted(set(PageDependency.objects.filter(cms_id=cms_id, key__in=list(keys)).values_list("path", flat=True)))
+
+    def get_keys(self, cms_id, path):
+        return sorted(PageDependency.objects.filter(cms_id=cms_id, path=path).values_list("key", flat=True))
+
+    def clear(self, cms_id=None):
+        dependencies = PageDependency.objects.all()
+        if cms_id is not None:
+            dependencies = dependencies.filter(cms_id=cms_id)
+        dependencies.delete()
+
+        with self._lock:
+            self._recorded = {}
+
+
+dependency_index = DependencyIndex()
+
+
+"""
+    query API
+"""
+# pages showing the template content, its listings or including it
+def get_pages_depending_on_template_content(template_content):
+    return dependency_index.get_pages(template_content.cms_id, get_template_content_keys(template_content))
+
+
+# pages rendered for the template content or including it
+def get_pages_showing_template_content(cms_id, template_content_id):
+    return dependency_index.get_pages(cms_id, [page_key(template_content_id)])
+
+
+# pages listing content of a type, e.g. with a navigation
+def get_pages_depending_on_content_type(cms_id, content_type):
+    return dependency_index.get_pages(cms_id, [content_type_key(cms_id, content_type)])
+
+
+# pages listing or including content of a template (get_template_content, include_latest_content)
+def get_pages_depending_on_template(cms_id, template_name):
+    return dependency_index.get_pages(cms_id, [template_key(cms_id, template_name)])
+
+
+# pages showing a global slot, all pages showing global content if content_type is None
+def get_pages_depending_on_global_content(cms_id, content_type=None):
+    if content_type is None:
+        return dependency_index.get_pages(cms_id, [global_key(cms_id)])
+    return dependency_index.get_pages(cms_id, [global_slot_key(cms_id, content_type)])
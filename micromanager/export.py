@@ -0,0 +1,515 @@
+"""
+    Static export
+    - renders the home page, the section home pages and every published LocalizedTemplateContent of a CMS
+      through the real views into a directory tree a web server can serve directly:
+        /                           -> index.html
+        /pages/<slug>/              -> pages/<slug>/index.html
+        /section/<section>/         -> section/<section>/index.html
+        /section/<section>/<slug>/  -> section/<section>/<slug>/index.html
+    - the pages of a section are the pages assigned to a type with the name of the section
+    - requests are built with RequestFactory and answered by the middleware and views of the project
+      in the exporting process, without the test client
+    - the static files of the theme and the published ContentImages are copied to STATIC_URL and MEDIA_URL
+    - pages are rendered in parallel by a pool of worker processes
+    - every file is written to a temporary file and renamed, readers never see half-written html
+    - export-manifest.json lists the sha256 of every exported file and the url and surrogate keys of every page
+
+    Incremental regeneration
+    - if MICROMANAGER_EXPORT_ON_PUBLISH is True, publishing a template content re-renders the pages in
+      MICROMANAGER_EXPORT_DIR which show it: the page itself and all pages whose surrogate keys
+      (see micromanager.surrogate) contain a key of the template content, e.g. pages with a navigation
+      listing it or pages including it
+    - changes to global content re-render the pages reading its slot, changes to navigations and
+      listings (types, titles and slugs of listed template contents) the pages showing them
+    - the pages are rendered by a background thread, publishing does not wait for it
+    - unpublishing a template content removes its pages and re-renders the pages showing it,
+      pages which do not exist anymore (404) are removed from the export
+"""
+from django.conf import settings
+from django.db import connections, transaction, close_old_connections
+from django.core.handlers.base import BaseHandler
+from django.test import RequestFactory
+from django.contrib.staticfiles import utils as staticfiles_utils
+
+from micromanager.compatibility import reverse
+from micromanager.models import CMS, CMSDomain, TemplateContent, LocalizedTemplateContent, ContentImages
+from micromanager.middleware import MULTI_TENANCY, theme_context
+from micromanager.finders import ThemeDirectoriesFinder
+from micromanager.surrogate import SURROGATE_KEY_HEADER, global_slot_key, get_template_content_keys
+from micromanager.signals import get_global_microcontent, get_navigation_keys
+
+import os, io, json, hashlib, shutil, multiprocessing, threading, logging
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+logger = logging.getLogger(__name__)
+
+EXPORT_MANIFEST_FILENAME = "export-manifest.json"
+EXPORT_DIR = getattr(settings, "MICROMANAGER_EXPORT_DIR", None)
+EXPORT_ON_PUBLISH = getattr(settings, "MICROMANAGER_EXPORT_ON_PUBLISH", False)
+
+
+def get_export_host(cms):
+    if MULTI_TENANCY == True:
+        cms_domain = CMSDomain.objects.filter(cms=cms).order_by("pk").first()
+        if cms_domain is not None:
+            return cms_domain.domain
+
+    for host in settings.ALLOWED_HOSTS:
+        if host and "*" not in host and not host.startswith("."):
+            return host
+
+    return "localhost"
+
+
+def get_sections(cms):
+    return sorted(cms.load_theme_settings().get("sections", {}))
+
+
+def _get_page_urls(localized_template_contents, sections):
+    # content (e.g. news) is rendered into pages, it has no page of its own
+    localized_template_contents = localized_template_contents.filter(
+        template_content__published_at__isnull=False).exclude(template_content__template_type="content")
+
+    slugs = localized_template_contents.order_by("pk").values_list("slug", flat=True)
+    urls = [reverse("micromanager_page", kwargs={"slug" : slug}) for slug in slugs]
+
+    for section in sections:
+        slugs = localized_template_contents.filter(
+            template_content__templatecontenttypes__content_type=section).order_by("pk").values_list("slug", flat=True)
+        urls += [reverse("micromanager_section_page", kwargs={"section" : section, "slug" : slug}) for slug in slugs]
+
+    return urls
+
+
+def get_export_urls(cms):
+    urls = [reverse("micromanager_home")]
+
+    sections = get_sections(cms)
+
+    for section in sections:
+        urls.append(reverse("micromanager_section", kwargs={"section" : section}))
+
+    urls += _get_page_urls(LocalizedTemplateContent.objects.filter(template_content__cms=cms), sections)
+
+    return urls
+
+
+def url_to_path(url):
+    path = url.strip("/")
+
+    if path:
+        return "%s/index.html" % path
+
+    return "index.html"
+
+
+def write_file(root, relpath, content):
+    path = os.path.join(root, relpath)
+
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder, exist_ok=True)
+
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+    with io.open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+    return hashlib.sha256(content).hexdigest()
+
+
+def remove_file(root, relpath):
+    path = os.path.join(root, relpath)
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def copy_file(root, relpath, source_path):
+    with io.open(source_path, "rb") as f:
+        content = f.read()
+    return write_file(root, relpath, content)
+
+
+"""
+    one handler per process, loading the middleware is not cheap
+"""
+_handler = None
+_handler_lock = threading.Lock()
+
+def get_handler():
+    global _handler
+
+    with _handler_lock:
+        if _handler is None:
+            handler = BaseHandler()
+            handler.load_middleware()
+            _handler = handler
+
+    return _handler
+
+
+def render_url(url, host, max_redirects=5):
+    request_factory = RequestFactory()
+
+    response = get_handler().get_response(request_factory.get(url, HTTP_HOST=host))
+
+    # the home page redirects to the page marked as home page
+    for redirect in range(max_redirects):
+        if response.status_code not in (301, 302):
+            break
+        response = get_handler().get_response(request_factory.get(response["Location"], HTTP_HOST=host))
+
+    # the page has been deleted or unpublished
+    if response.status_code == 404:
+        return None, []
+
+    if response.status_code != 200:
+        raise ExportError("%s returned status %s" % (url, response.status_code))
+
+    keys = response.get(SURROGATE_KEY_HEADER, "").split()
+
+    return response.content, keys
+
+
+class ExportError(Exception):
+    pass
+
+
+# returns (relpath, sha256, surrogate keys), sha256 is None if the page does not exist
+def export_url(root, host, url):
+    relpath = url_to_path(url)
+    content, keys = render_url(url, host)
+
+    if content is None:
+        return relpath, None, keys
+
+    return relpath, write_file(root, relpath, content), keys
+
+
+def _init_worker():
+    import django
+    django.setup()
+    # forked workers must not share the database connections of the parent
+    connections.close_all()
+
+
+def _export_url_worker(args):
+    root, host, url = args
+    try:
+        return (url,) + export_url(root, host, url) + (None,)
+    except Exception as e:
+        return url, url_to_path(url), None, [], "%s: %s" % (url, e)
+
+
+def export_urls(root, host, urls, workers=1):
+    jobs = [(root, host, url) for url in urls]
+
+    if workers <= 1 or len(jobs) <= 1:
+        return [_export_url_worker(job) for job in jobs]
+
+    connections.close_all()
+    pool = multiprocessing.Pool(processes=workers, initializer=_init_worker)
+    try:
+        results = pool.map(_export_url_worker, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def copy_theme_static(root, theme):
+    static_root = settings.STATIC_URL.strip("/")
+
+    hashes = {}
+
+    with theme_context(theme):
+        finder = ThemeDirectoriesFinder()
+
+        if finder.storage is None:
+            return hashes
+
+        for path in staticfiles_utils.get_files(finder.storage):
+            relpath = "/".join([part for part in [static_root, path.replace(os.sep, "/")] if part])
+            hashes[relpath] = copy_file(root, relpath, finder.storage.path(path))
+
+    return hashes
+
+
+def copy_published_images(root, cms, template_content=None):
+    media_root = settings.MEDIA_URL.strip("/")
+
+    hashes = {}
+
+    content_images = ContentImages.objects.filter(cms=cms).exclude(published_content="")
+    if template_content is not None:
+        content_images = content_images.filter(template_content=template_content)
+
+    for content_image in content_images:
+        if not content_image.published_content or not os.path.isfile(content_image.published_content.path):
+            continue
+
+        relpath = "/".join([part for part in [media_root, content_image.published_content.name] if part])
+        hashes[relpath] = copy_file(root, relpath, content_image.published_content.path)
+
+    return hashes
+
+
+def read_export_manifest(root):
+    try:
+        with open(os.path.join(root, EXPORT_MANIFEST_FILENAME), "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_export_manifest(root, manifest):
+    content = json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8")
+    write_file(root, EXPORT_MANIFEST_FILENAME, content)
+
+
+def get_export_root(root, cms):
+    # each CMS gets its own folder if several sites are served by this deployment
+    if MULTI_TENANCY == True and CMS.objects.count() > 1:
+        return os.path.join(root, get_export_host(cms))
+    return root
+
+
+"""
+    export a CMS, returns (manifest, errors)
+"""
+def export_cms(root, cms, workers=1, clean=False):
+
+    if clean and os.path.isdir(root):
+        shutil.rmtree(root)
+
+    host = get_export_host(cms)
+
+    files = {}
+    pages = {}
+    errors = []
+
+    for url, relpath, sha256, keys, error in export_urls(root, host, get_export_urls(cms), workers=workers):
+        if error is not None:
+            errors.append(error)
+        elif sha256 is not None:
+            files[relpath] = sha256
+            pages[relpath] = {"url" : url, "keys" : keys}
+
+    files.update(copy_theme_static(root, cms.theme))
+    files.update(copy_published_images(root, cms))
+
+    manifest = {
+        "cms" : cms.pk,
+        "host" : host,
+        "files" : files,
+        "pages" : pages,
+    }
+    write_export_manifest(root, manifest)
+
+    return manifest, errors
+
+
+"""
+    re-render urls of an export, the caller holds _manifest_lock
+"""
+_manifest_lock = threading.Lock()
+
+def _regenerate_urls(root, manifest, urls):
+    errors = []
+
+    for url, relpath, sha256, keys, error in export_urls(root, manifest["host"], sorted(urls)):
+        if error is not None:
+            errors.append(error)
+        elif sha256 is None:
+            remove_file(root, relpath)
+            manifest.setdefault("pages", {}).pop(relpath, None)
+            manifest["files"].pop(relpath, None)
+        else:
+            manifest["files"][relpath] = sha256
+            manifest.setdefault("pages", {})[relpath] = {"url" : url, "keys" : keys}
+
+    return errors
+
+
+"""
+    re-render the exported pages showing a template content, returns the list of errors
+"""
+def regenerate_template_content(root, template_content):
+
+    with _manifest_lock:
+
+        manifest = read_export_manifest(root)
+
+        if manifest is None:
+            # nothing has been exported yet
+            return []
+
+        template_content_keys = set(get_template_content_keys(template_content))
+
+        sections = get_sections(template_content.cms)
+
+        localized_template_contents = LocalizedTemplateContent.objects.filter(template_content=template_content)
+        urls = set(_get_page_urls(localized_template_contents, sections))
+
+        # the pages of an unpublished template content (or removed from a section) are removed from the export
+        removed_urls = set()
+        for slug in localized_template_contents.values_list("slug", flat=True):
+            removed_urls.add(reverse("micromanager_page", kwargs={"slug" : slug}))
+            for section in sections:
+                removed_urls.add(reverse("micromanager_section_page", kwargs={"section" : section, "slug" : slug}))
+        removed_urls -= urls
+
+        for relpath, page in list(manifest.get("pages", {}).items()):
+            if page["url"] in removed_urls:
+                remove_file(root, relpath)
+                manifest["pages"].pop(relpath)
+                manifest["files"].pop(relpath, None)
+            elif template_content_keys.intersection(page["keys"]):
+                urls.add(page["url"])
+
+        errors = _regenerate_urls(root, manifest, urls)
+
+        manifest["files"].update(copy_published_images(root, template_content.cms, template_content=template_content))
+
+        write_export_manifest(root, manifest)
+
+    return errors
+
+
+"""
+    re-render the exported pages tagged with one of the surrogate keys, returns the list of errors
+    - used for global content and navigations, which have no page of their own
+"""
+def regenerate_keys(root, keys):
+
+    with _manifest_lock:
+
+        manifest = read_export_manifest(root)
+
+        if manifest is None:
+            return []
+
+        keys = set(keys)
+        urls = set([page["url"] for page in manifest.get("pages", {}).values() if keys.intersection(page["keys"])])
+
+        errors = _regenerate_urls(root, manifest, urls)
+
+        write_export_manifest(root, manifest)
+
+    return errors
+
+
+"""
+    items are ("template_content", template_content_id) or ("keys", cms_id, keys)
+"""
+class RegenerationQueue(object):
+
+    def __init__(self, root):
+        self.root = root
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micromanager-regeneration")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def put(self, template_content_id):
+        self._start()
+        self.queue.put(("template_content", template_content_id))
+
+    def put_keys(self, cms_id, keys):
+        self._start()
+        self.queue.put(("keys", cms_id, tuple(sorted(set(keys)))))
+
+    def _get_pending(self):
+        items = [self.queue.get()]
+
+        # a publish burst only re-renders shared pages (e.g. with navigations) once per item
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item not in items:
+                items.append(item)
+
+        return items
+
+    def _regenerate(self, item):
+        if item[0] == "keys":
+            cms = CMS.objects.filter(pk=item[1]).first()
+            if cms is None:
+                return []
+            return regenerate_keys(get_export_root(self.root, cms), item[2])
+
+        template_content = TemplateContent.objects.filter(pk=item[1]).first()
+        if template_content is None:
+            return []
+
+        return regenerate_template_content(get_export_root(self.root, template_content.cms), template_content)
+
+    def _run(self):
+        while True:
+            for item in self._get_pending():
+                close_old_connections()
+                try:
+                    for error in self._regenerate(item):
+                        logger.error("regenerating %s failed: %s" % (item[1], error))
+
+                except Exception:
+                    logger.exception("regenerating %s failed" % (item[1],))
+
+            close_old_connections()
+
+
+regeneration_queue = None
+
+def get_regeneration_queue():
+    global regeneration_queue
+
+    if regeneration_queue is None:
+        regeneration_queue = RegenerationQueue(EXPORT_DIR)
+
+    return regeneration_queue
+
+
+def regenerate_on_publish(sender, template_content, **kwargs):
+    if EXPORT_DIR is None:
+        return
+
+    template_content_id = template_content.pk
+    transaction.on_commit(lambda: get_regeneration_queue().put(template_content_id))
+
+
+def _regenerate_keys_on_commit(cms_id, keys):
+    if EXPORT_DIR is None or cms_id is None or not keys:
+        return
+
+    transaction.on_commit(lambda: get_regeneration_queue().put_keys(cms_id, keys))
+
+
+def regenerate_on_global_content_change(sender, instance, **kwargs):
+    microcontent = get_global_microcontent(instance)
+
+    if microcontent is not None:
+        _regenerate_keys_on_commit(microcontent.cms_id, [global_slot_key(microcontent.cms_id,
+                                                                         microcontent.content_type)])
+
+
+def regenerate_on_navigation_change(sender, instance, **kwargs):
+    # TemplateContentTypes has no cms of its own
+    cms_id = getattr(instance, "cms_id", None)
+    if cms_id is None:
+        cms_id = TemplateContent.objects.filter(pk=instance.template_content_id).values_list(
+                    "cms_id", flat=True).first()
+
+    _regenerate_keys_on_commit(cms_id, get_navigation_keys(instance, **kwargs))
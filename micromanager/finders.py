@@ -8,6 +8,7 @@ import os
 from collections import OrderedDict
 
 from micromanager.middleware import get_current_theme
+from micromanager.themes import theme_registry
 
 searched_locations = []
 
@@ -28,9 +29,7 @@ class ThemeDirectoriesFinder(BaseFinder):
 
         if self.theme is not None:
 
-            app_config = apps.get_app_config('micromanager')
-
-            theme_path = os.path.join(app_config.path, 'themes', self.theme)
+            theme_path = theme_registry.get_theme_path(self.theme)
             
             theme_storage = self.storage_class(
                 os.path.join(theme_path, self.source_dir))
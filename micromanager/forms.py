@@ -4,9 +4,11 @@ from django.utils.translation import ugettext as _
 
 import os
 
-from micromanager.parser import TemplateParser
+from micromanager.manifest import get_cms_tags
+from micromanager.middleware import get_current_theme
 from micromanager.CMSObjects import Theme
-from micromanager.models import INSTALLED_THEMES, CMSLanguages
+from micromanager.models import CMSLanguages
+from micromanager.themes import get_installed_themes
 
 from django.template import loader
 
@@ -50,8 +52,11 @@ class ManageMicroContentsForm(forms.Form):
     def _append_additional_fields(self):
         pass
 
-    def _template(self):
-        return self.template_content.get_template()
+    def _theme_name(self):
+        return self.template_content.cms.theme
+
+    def _template_name(self):
+        return self.template_content.template_name
 
     def __init__(self, template_content, language, *args, **kwargs):
 
@@ -67,12 +72,8 @@ class ManageMicroContentsForm(forms.Form):
         self.layoutable_full_fields = set([])
         self.layoutable_simple_fields = set([])
 
-        # read the template and find microcontent
-        template = self._template()
-
-        # find all cms template tags in source
-        parser = TemplateParser(template)
-        cms_tags = parser.parse()
+        # the cms template tags of the template, read from the theme manifest
+        cms_tags = get_cms_tags(self._theme_name(), self._template_name())
 
         # the fields should be in self.fields        
         for tag in cms_tags:
@@ -93,6 +94,10 @@ class ManageTemplateContentForm(ManageMicroContentsForm):
     title = forms.CharField()
     is_home_page = forms.BooleanField(required=False)
     page_types = forms.MultipleChoiceField(label=_('Show in'), required=False)
+    publish_at = forms.DateTimeField(label=_('Publish at'), required=False,
+                                     help_text=_('YYYY-MM-DD HH:MM, the content is published automatically'))
+    unpublish_at = forms.DateTimeField(label=_('Unpublish at'), required=False,
+                                       help_text=_('YYYY-MM-DD HH:MM, the content is taken offline automatically'))
 
 
     def _append_additional_fields(self):
@@ -127,12 +132,15 @@ class ManagePagebaseForm(ManageMicroContentsForm):
         self.template = template
         super(ManagePagebaseForm, self).__init__(None, language, *args, **kwargs)
 
-    def _template(self):
-        return self.template
+    def _theme_name(self):
+        return get_current_theme()
+
+    def _template_name(self):
+        return self.template.origin.template_name
     
 # the Page with template_name base.html
 class ThemeSettingsForm(forms.Form):
-    theme = forms.ChoiceField(choices=INSTALLED_THEMES)
+    theme = forms.ChoiceField(choices=get_installed_themes)
         
         
 class DeleteContentForm(forms.Form):
@@ -161,13 +169,12 @@ class AddLanguageForm(forms.ModelForm):
         fields = ("language",)
     
 
-from .models import _get_themes
 class FirstTimeSetupForm(forms.Form):
     cms_name = forms.CharField(label=_('Name of your website'))
     primary_language = forms.ChoiceField(choices=settings.LANGUAGES,
                                          help_text=_('You can set additional languages later'))
 
-    theme = forms.ChoiceField(choices=_get_themes())
+    theme = forms.ChoiceField(choices=get_installed_themes)
 
 
 '''
@@ -0,0 +1,224 @@
+"""
+    Job queue
+    - slow work of the admin (publishing, deleting content and its files, purging proxies) runs as Job,
+      stored in the database
+    - if MICROMANAGER_JOB_QUEUE is True, jobs are only stored and run by ``manage.py micromanager_worker``,
+      the admin polls the status of a job with the micromanager_job_status view
+    - otherwise jobs run immediately in the process creating them, as before
+    - a job is claimed with an UPDATE ... WHERE status = 'pending', several workers never run the same job
+    - the handler of a job runs in a transaction, its return value is stored as the result of the job
+"""
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils import timezone
+
+from micromanager.models import Job, TemplateContent, ContentImages
+
+import os, json, shutil, threading, time, logging, datetime
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE = getattr(settings, "MICROMANAGER_JOB_QUEUE", False)
+# running jobs older than this are considered lost (e.g. the worker was killed) and run again
+JOB_TIMEOUT = getattr(settings, "MICROMANAGER_JOB_TIMEOUT", 3600)
+
+
+class JobError(Exception):
+    pass
+
+
+job_handlers = {}
+
+def register_job(kind):
+    def decorator(func):
+        job_handlers[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, cms=None, user=None, **payload):
+    if kind not in job_handlers:
+        raise JobError("Unknown job: %s" % kind)
+
+    job = Job.objects.create(kind=kind, cms=cms, created_by=user, payload=json.dumps(payload))
+
+    if JOB_QUEUE != True:
+        job.status = "running"
+        job.started_at = timezone.now()
+        run_job(job)
+
+    return job
+
+
+def run_job(job):
+    try:
+        with transaction.atomic():
+            result = job_handlers[job.kind](**job.get_payload())
+        job.status = "finished"
+    except Exception as e:
+        logger.exception("job %s (%s) failed" % (job.pk, job.kind))
+        result = {"errors" : [str(e)]}
+        job.status = "failed"
+
+    job.result = json.dumps(result or {})
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "result", "started_at", "finished_at"])
+
+    return job
+
+
+def claim_job():
+    pending = Job.objects.filter(status="pending").order_by("created_at", "pk").values_list("pk", flat=True)
+
+    for job_id in pending[:10]:
+        # only one worker succeeds in updating the row
+        claimed = Job.objects.filter(pk=job_id, status="pending").update(status="running",
+                                                                         started_at=timezone.now())
+        if claimed:
+            return Job.objects.get(pk=job_id)
+
+    return None
+
+
+def requeue_lost_jobs(timeout=JOB_TIMEOUT):
+    started_before = timezone.now() - datetime.timedelta(seconds=timeout)
+    return Job.objects.filter(status="running", started_at__lt=started_before).update(status="pending",
+                                                                                     started_at=None)
+
+
+class Worker(object):
+
+    def __init__(self, threads=1, poll_interval=1, once=False):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.once = once
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    # returns False if there was no job to run
+    def _run_next(self):
+        close_old_connections()
+
+        job = claim_job()
+
+        if job is None:
+            return False
+
+        started_at = time.time()
+        run_job(job)
+        logger.info("job %s (%s) %s in %.1fms" % (job.pk, job.kind, job.status,
+                                                 (time.time() - started_at) * 1000))
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            # e.g. the database went away, the thread must survive it
+            try:
+                found = self._run_next()
+            except Exception:
+                logger.exception("micromanager worker failed")
+                found = False
+
+            if not found:
+                if self.once:
+                    break
+                self._stopped.wait(self.poll_interval)
+
+        close_old_connections()
+
+    def run(self):
+        requeue_lost_jobs()
+
+        threads = [threading.Thread(target=self._run, name="micromanager-worker-%s" % i)
+                   for i in range(self.threads)]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+
+"""
+    files and folders are removed by a job if MICROMANAGER_JOB_QUEUE is True, after the transaction
+    deleting their database rows has been committed
+"""
+def _remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+
+def remove_path(path):
+    if JOB_QUEUE == True:
+        transaction.on_commit(lambda: enqueue("remove_paths", paths=[path]))
+    else:
+        _remove_path(path)
+
+
+"""
+    handlers
+"""
+@register_job("remove_paths")
+def remove_paths_job(paths):
+    for path in paths:
+        _remove_path(path)
+    return {"removed" : len(paths)}
+
+
+@register_job("purge_keys")
+def purge_keys_job(keys):
+    from micromanager.purgers import get_purger
+
+    purger = get_purger()
+    if purger is not None:
+        purger.purge(set(keys))
+
+    return {"purged" : len(keys)}
+
+
+@register_job("publish_template_content")
+def publish_template_content_job(template_content_id, language="all"):
+    from micromanager.publishing import publish_template_content
+
+    template_content = TemplateContent.objects.filter(pk=template_content_id).first()
+    if template_content is None:
+        raise JobError("Template content %s does not exist" % template_content_id)
+
+    result = publish_template_content(template_content, language=language)
+
+    return {
+        "errors" : [str(error) for error in result.errors],
+        "timings" : result.timings,
+    }
+
+
+@register_job("delete_template_content")
+def delete_template_content_job(template_content_id):
+
+    template_content = TemplateContent.objects.filter(pk=template_content_id).first()
+    if template_content is None:
+        return {}
+
+    paths = []
+    for content_image in ContentImages.objects.filter(template_content=template_content):
+        for image in [content_image.draft_content, content_image.published_content]:
+            if image:
+                paths.append(image.path)
+
+    template_content.delete()
+
+    # the images are only removed if the deletion has been committed
+    transaction.on_commit(lambda: [_remove_path(path) for path in paths])
+
+    return {"removed" : len(paths)}
@@ -1,35 +1,162 @@
 from django.template.loaders.base import Loader as BaseLoader
+from django.template.loaders.cached import Loader as CachedLoader
 from django.core.exceptions import SuspiciousFileOperation
 from django.utils._os import safe_join
-from django.template import TemplateDoesNotExist
+from django.template import Origin, TemplateDoesNotExist, TemplateSyntaxError, loader
+from django.db import DatabaseError
 import os, io
 
-from micromanager.middleware import get_current_theme
+from micromanager.middleware import get_current_theme, theme_context
+from micromanager.themes import theme_registry
 
 class ThemeLoader(BaseLoader):
     is_usable = True
 
-    def get_template_sources(self, template_name, template_dirs=None):        
+    def get_template_sources(self, template_name, template_dirs=None):
         """
-        An iterator that yields possible matching template paths for a
+        An iterator that yields possible matching template origins for a
         template name.
-        """        
+        """
         theme = get_current_theme()
-        template_dir = os.path.join(os.path.dirname(__file__), "themes", theme, "templates")
+        if theme is None:
+            return
+
+        template_dir = os.path.join(theme_registry.get_theme_path(theme), "templates")
 
         if os.path.isdir(template_dir):
             try:
-                yield safe_join(template_dir, template_name)
+                name = safe_join(template_dir, template_name)
             except SuspiciousFileOperation:
-                pass
-        
+                return
+
+            yield Origin(
+                name=name,
+                template_name=template_name,
+                loader=self,
+            )
+
+
+    def get_contents(self, origin):
+        try:
+            with io.open(origin.name, encoding=self.engine.file_charset) as fp:
+                return fp.read()
+        except IOError:
+            raise TemplateDoesNotExist(origin)
+
 
     def load_template_source(self, template_name, template_dirs=None):
-        for filepath in self.get_template_sources(template_name, template_dirs):
+        for origin in self.get_template_sources(template_name, template_dirs):
             try:
-                with io.open(filepath, encoding=self.engine.file_charset) as fp:
-                    return fp.read(), filepath
-            except IOError:
+                return self.get_contents(origin), origin.name
+            except TemplateDoesNotExist:
                 pass
         raise TemplateDoesNotExist(template_name)
-        
+
+
+"""
+    CachedThemeLoader
+    - django's cached loader keys templates by name only and would return the base.html of one theme
+      for all other themes, too
+    - this loader keys compiled templates by (theme, template_name)
+    - if theme settings are reloaded (MICROMANAGER_THEME_RELOAD_INTERVAL, debug mode) the template files are
+      checked for modifications on every access
+    - usage in TEMPLATES['OPTIONS']['loaders']:
+        ('micromanager.loaders.CachedThemeLoader', ['micromanager.loaders.ThemeLoader']),
+"""
+class CachedThemeLoader(CachedLoader):
+
+    def __init__(self, engine, loaders=None):
+        if loaders is None:
+            loaders = ['micromanager.loaders.ThemeLoader']
+
+        super(CachedThemeLoader, self).__init__(engine, loaders)
+
+        self.check_mtime = theme_registry.reload_interval is not None
+        self._mtimes = {}
+
+    def cache_key(self, template_name, *args, **kwargs):
+        key = super(CachedThemeLoader, self).cache_key(template_name, *args, **kwargs)
+        return "%s:%s" % (get_current_theme(), key)
+
+    def _is_modified(self, key):
+        if key not in self._mtimes:
+            return False
+
+        path, mtime = self._mtimes[key]
+        try:
+            return os.path.getmtime(path) != mtime
+        except OSError:
+            return True
+
+    def get_template(self, template_name, *args, **kwargs):
+
+        if not self.check_mtime:
+            return super(CachedThemeLoader, self).get_template(template_name, *args, **kwargs)
+
+        key = self.cache_key(template_name, *args, **kwargs)
+
+        if self._is_modified(key):
+            # a template may be included in or extended by others, drop all compiled templates
+            self.reset()
+
+        template = super(CachedThemeLoader, self).get_template(template_name, *args, **kwargs)
+
+        if key not in self._mtimes and template.origin.name and os.path.isfile(template.origin.name):
+            self._mtimes[key] = (template.origin.name, os.path.getmtime(template.origin.name))
+
+        return template
+
+    def reset(self):
+        super(CachedThemeLoader, self).reset()
+        self._mtimes = {}
+
+
+"""
+    compile all templates of the given themes, e.g. when a worker boots
+    - if no themes are given, the themes used by at least one CMS are warmed
+"""
+def get_active_themes():
+    from micromanager.models import CMS
+
+    try:
+        theme_names = list(CMS.objects.values_list("theme", flat=True).distinct())
+    except DatabaseError:
+        theme_names = []
+
+    if not theme_names:
+        theme_names = theme_registry.get_theme_names()
+
+    return theme_names
+
+
+def get_theme_template_names(theme_name):
+    template_dir = os.path.join(theme_registry.get_theme_path(theme_name), "templates")
+
+    template_names = []
+
+    for root, dirs, files in os.walk(template_dir):
+        for filename in files:
+            if filename.endswith(".html"):
+                path = os.path.join(root, filename)
+                template_names.append(os.path.relpath(path, template_dir).replace(os.sep, "/"))
+
+    return sorted(template_names)
+
+
+def warm_template_cache(theme_names=None):
+
+    if theme_names is None:
+        theme_names = get_active_themes()
+
+    warmed = 0
+
+    for theme_name in theme_names:
+        with theme_context(theme_name):
+            for template_name in get_theme_template_names(theme_name):
+                try:
+                    loader.get_template(template_name)
+                    warmed += 1
+                except (TemplateDoesNotExist, TemplateSyntaxError):
+                    pass
+
+    return warmed
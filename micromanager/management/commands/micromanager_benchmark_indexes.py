@@ -0,0 +1,189 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from micromanager.models import (CMS, TemplateContent, LocalizedTemplateContent, TemplateContentTypes, MicroContent,
+                                 ContentImages)
+
+import datetime, time
+
+TEMPLATE_NAMES = ["pages/page-%s.html" % i for i in range(20)] + ["content/news.html"]
+CONTENT_TYPES = ["text", "headline", "teaser", "image"]
+NAVIGATIONS = ["Navigation", "footer", "Blog"]
+
+# the indexes of migration 0009, dropped to measure the queries without them
+COMPOSITE_INDEXES = [
+    (TemplateContent, ["cms_id", "template_name", "published_at"]),
+    (TemplateContent, ["cms_id", "is_home_page"]),
+    (LocalizedTemplateContent, ["template_content_id", "language"]),
+    (TemplateContentTypes, ["content_type", "position"]),
+    (MicroContent, ["template_content_id", "content_type"]),
+    (ContentImages, ["template_content_id", "content_type"]),
+]
+PARTIAL_INDEXES = ["micromanager_mc_global", "micromanager_ci_global"]
+WARMUP = 5
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Seeds a CMS with many template contents and prints query plans and timings of the hot lookups '
+            'with and without the indexes of migration 0009. Everything is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='number of template contents to create')
+        parser.add_argument('--repeat', type=int, default=50, help='runs per query, the median is reported')
+
+    def handle(self, *args, **options):
+
+        if connection.vendor not in ['postgresql', 'sqlite']:
+            raise CommandError('The benchmark drops indexes inside a transaction, which %s does not support' % (
+                connection.vendor))
+
+        try:
+            with transaction.atomic():
+                cms = self.seed(options['rows'])
+                queries = self.get_queries(cms)
+
+                after = self.run_queries(queries, options['repeat'], "after")
+                self.drop_indexes()
+                before = self.run_queries(queries, options['repeat'], "before")
+
+                self.report(queries, before, after)
+
+                raise Rollback()
+        except Rollback:
+            pass
+
+
+    def seed(self, rows):
+        started_at = time.time()
+
+        User = get_user_model()
+        user = User.objects.create(username="micromanager-benchmark")
+
+        cms = CMS.objects.create("benchmark", "benchmark", "en")
+        now = timezone.now()
+
+        template_contents = []
+        for i in range(rows):
+            template_contents.append(TemplateContent(
+                cms=cms,
+                template_name=TEMPLATE_NAMES[i % len(TEMPLATE_NAMES)],
+                template_type="content" if i % len(TEMPLATE_NAMES) == len(TEMPLATE_NAMES) - 1 else "page",
+                published_version=1 if i % 2 == 0 else None,
+                published_at=now - datetime.timedelta(minutes=i) if i % 2 == 0 else None,
+                is_home_page=(i == 0),
+            ))
+        TemplateContent.objects.bulk_create(template_contents)
+
+        template_content_ids = list(TemplateContent.objects.filter(cms=cms).order_by("pk").values_list("pk", flat=True))
+
+        LocalizedTemplateContent.objects.bulk_create([
+            LocalizedTemplateContent(cms=cms, template_content_id=template_content_id, language=language,
+                                     slug="benchmark-%s-%s" % (language, template_content_id), title="Benchmark",
+                                     creator=user, draft_version=1)
+            for template_content_id in template_content_ids for language in ["en", "de"]
+        ])
+
+        TemplateContentTypes.objects.bulk_create([
+            TemplateContentTypes(template_content_id=template_content_id, content_type=NAVIGATIONS[i % len(NAVIGATIONS)],
+                                 position=i)
+            for i, template_content_id in enumerate(template_content_ids) if i % 10 == 0
+        ])
+
+        MicroContent.objects.bulk_create([
+            MicroContent(cms=cms, template_content_id=template_content_id, content_type=content_type)
+            for template_content_id in template_content_ids for content_type in CONTENT_TYPES[:3]
+        ] + [MicroContent(cms=cms, template_content=None, content_type="global-%s" % i) for i in range(50)])
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        self.stdout.write("seeded %s template contents in %.1fs" % (rows, time.time() - started_at))
+
+        return cms
+
+
+    def get_queries(self, cms):
+        template_content_id = TemplateContent.objects.filter(cms=cms).order_by("-pk").values_list(
+                                "pk", flat=True)[len(TEMPLATE_NAMES) * 10]
+
+        return [
+            ("microcontent of a page",
+             MicroContent.objects.filter(template_content_id=template_content_id, content_type="teaser")),
+            ("locale of a page",
+             LocalizedTemplateContent.objects.filter(template_content_id=template_content_id, language="de")),
+            ("listing by content type", LocalizedTemplateContent.objects.filter(
+                template_content__cms=cms, language="en", template_content__templatecontenttypes__content_type="footer",
+                template_content__published_at__isnull=False).order_by(
+                "template_content__templatecontenttypes__position", "template_content_id")[:10]),
+            ("listing by template", LocalizedTemplateContent.objects.filter(
+                template_content__cms=cms, language="en", template_content__template_name="content/news.html",
+                template_content__published_at__isnull=False).order_by(
+                "-template_content__published_at", "-template_content_id")[:10]),
+            ("home page", TemplateContent.objects.filter(cms=cms, is_home_page=True, published_version__isnull=False)),
+            ("global content", MicroContent.objects.filter(cms=cms, template_content__isnull=True,
+                                                           content_type="global-7")),
+        ]
+
+
+    # the label makes the statement unique, sqlite would reuse the plan prepared before the indexes were dropped
+    def explain(self, queryset, label):
+        sql, params = queryset.query.sql_with_params()
+
+        if connection.vendor == "postgresql":
+            sql = "EXPLAIN ANALYZE %s /* %s */" % (sql, label)
+        else:
+            sql = "EXPLAIN QUERY PLAN %s /* %s */" % (sql, label)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [" ".join([str(column) for column in row]) for row in cursor.fetchall()]
+
+
+    def run_queries(self, queries, repeat, label):
+        results = []
+
+        for name, queryset in queries:
+            # untimed warm-up: both runs read from warm caches, the first measured run is not penalized
+            for i in range(WARMUP):
+                list(queryset.all())
+
+            durations = []
+            for i in range(repeat):
+                started_at = time.time()
+                list(queryset.all())
+                durations.append(time.time() - started_at)
+
+            durations.sort()
+            results.append((durations[len(durations) // 2] * 1000, self.explain(queryset, label)))
+
+        return results
+
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for Model, columns in COMPOSITE_INDEXES:
+                table = Model._meta.db_table
+                for name, constraint in connection.introspection.get_constraints(cursor, table).items():
+                    if constraint["index"] and not constraint["unique"] and constraint["columns"] == columns:
+                        cursor.execute("DROP INDEX %s" % connection.ops.quote_name(name))
+
+            for name in PARTIAL_INDEXES:
+                cursor.execute("DROP INDEX IF EXISTS %s" % name)
+
+
+    def report(self, queries, before, after):
+        for (name, queryset), (before_ms, before_plan), (after_ms, after_plan) in zip(queries, before, after):
+            self.stdout.write("")
+            self.stdout.write("%s: %.2fms -> %.2fms" % (name, before_ms, after_ms))
+            self.stdout.write("  before:")
+            for line in before_plan:
+                self.stdout.write("    %s" % line)
+            self.stdout.write("  after:")
+            for line in after_plan:
+                self.stdout.write("    %s" % line)
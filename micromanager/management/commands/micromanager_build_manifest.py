@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from micromanager.manifest import (build_manifest, write_manifest, read_manifest, manifest_rebuilt, manifest_registry,
+                                   get_theme_manifest_path)
+from micromanager.themes import theme_registry
+
+
+class Command(BaseCommand):
+    help = 'Scans the templates of themes and writes the manifest of all cms_* content slots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('themes', nargs='*', help='names of the themes, default: all installed themes')
+        parser.add_argument('--theme-folder', action='store_true',
+                            help='write the manifest into the theme folder, to ship it with the theme')
+
+    def handle(self, *args, **options):
+
+        theme_names = options['themes'] or theme_registry.get_theme_names()
+
+        built = []
+
+        for theme_name in theme_names:
+            previous = read_manifest(theme_name)
+            manifest = build_manifest(theme_name)
+            if options['theme_folder']:
+                manifest_path = write_manifest(manifest, get_theme_manifest_path(theme_name))
+            else:
+                manifest_path = write_manifest(manifest)
+
+            built.append((theme_name, previous, manifest))
+
+            slot_count = sum(len(slots) for slots in manifest.data['slots'].values())
+            self.stdout.write('%s: %s templates, %s slots -> %s' % (theme_name, len(manifest.data['slots']),
+                                                                   slot_count, manifest_path))
+
+        manifest_registry.clear()
+
+        # processes reading the new manifests do not rebuild them
+        for theme_name, previous, manifest in built:
+            manifest_rebuilt(theme_name, previous, manifest)
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from micromanager.models import CMS
+from micromanager.export import export_cms, get_export_root
+
+import multiprocessing, time
+
+
+class Command(BaseCommand):
+    help = 'Renders all published pages, copies theme static files and published images into a static site'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', nargs='?', default=getattr(settings, 'MICROMANAGER_EXPORT_DIR', None),
+                            help='target directory, default: MICROMANAGER_EXPORT_DIR')
+        parser.add_argument('--workers', type=int,
+                            default=getattr(settings, 'MICROMANAGER_EXPORT_WORKERS', multiprocessing.cpu_count()),
+                            help='number of rendering processes')
+        parser.add_argument('--cms', type=int, action='append', dest='cms_ids', help='id of a CMS, default: all')
+        parser.add_argument('--clean', action='store_true', help='remove the output directory first')
+
+    def handle(self, *args, **options):
+
+        if not options['output_dir']:
+            raise CommandError('No output directory given and MICROMANAGER_EXPORT_DIR is not set')
+
+        cmss = CMS.objects.all().order_by('pk')
+        if options['cms_ids']:
+            cmss = cmss.filter(pk__in=options['cms_ids'])
+
+        failed = False
+
+        for cms in cmss:
+            root = get_export_root(options['output_dir'], cms)
+
+            started_at = time.time()
+            manifest, errors = export_cms(root, cms, workers=options['workers'], clean=options['clean'])
+
+            self.stdout.write('%s: %s files in %.2fs -> %s' % (cms.name, len(manifest['files']),
+                                                              time.time() - started_at, root))
+
+            for error in errors:
+                failed = True
+                self.stderr.write(error)
+
+        if failed:
+            raise CommandError('Some pages could not be exported')
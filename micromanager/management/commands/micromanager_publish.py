@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from micromanager.models import CMS, TemplateContent, PublishBatch
+from micromanager.publishing import create_publish_batch, run_publish_batch, DEFAULT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Publishes many template contents in chunks, an interrupted batch can be resumed with --resume'
+
+    def add_arguments(self, parser):
+        parser.add_argument('template_content_ids', nargs='*', type=int, help='ids of the template contents to publish')
+        parser.add_argument('--all', action='store_true', dest='all_changed',
+                            help='publish all template contents with unpublished changes')
+        parser.add_argument('--cms', type=int, dest='cms_id', help='id of the CMS, default: the first CMS')
+        parser.add_argument('--language', default='all')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, dest='chunk_size')
+        parser.add_argument('--resume', type=int, dest='batch_id', help='id of an interrupted batch')
+
+    def handle(self, *args, **options):
+
+        if options['batch_id']:
+            batch = PublishBatch.objects.filter(pk=options['batch_id']).first()
+            if batch is None:
+                raise CommandError('Batch %s does not exist' % options['batch_id'])
+
+        else:
+            if options['cms_id']:
+                cms = CMS.objects.filter(pk=options['cms_id']).first()
+            else:
+                cms = CMS.objects.all().order_by('pk').first()
+
+            if cms is None:
+                raise CommandError('CMS not found')
+
+            if options['all_changed']:
+                template_contents = TemplateContent.objects.filter(Q(published_version__isnull=True) |
+                                                                   ~Q(published_version=F('draft_version')))
+            elif options['template_content_ids']:
+                template_contents = options['template_content_ids']
+            else:
+                raise CommandError('Pass ids of template contents or --all')
+
+            batch = create_publish_batch(cms, template_contents, language=options['language'])
+
+        self.stdout.write('batch %s: %s template contents' % (batch.pk, batch.total))
+
+        for progress in run_publish_batch(batch, chunk_size=options['chunk_size']):
+            if progress.errors:
+                self.stderr.write(str(progress))
+            else:
+                self.stdout.write(str(progress))
+
+        self.stdout.write('batch %s: %s published, %s failed' % (batch.pk, batch.published_count, batch.failed_count))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from micromanager.models import CMS, TemplateContent, TranslationStatus
+from micromanager.completeness import update_translation_status
+
+CHUNK_SIZE = 200
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored translation status of all localized template contents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cms', type=int, action='append', dest='cms_ids', help='id of a CMS, default: all')
+
+    def handle(self, *args, **options):
+
+        cmss = CMS.objects.all().order_by('pk')
+        if options['cms_ids']:
+            cmss = cmss.filter(pk__in=options['cms_ids'])
+
+        for cms in cmss:
+            template_contents = list(TemplateContent.objects.filter(cms=cms).order_by('pk'))
+
+            with transaction.atomic():
+                TranslationStatus.objects.filter(localized_template_content__template_content__cms=cms).delete()
+
+                count = 0
+                for start in range(0, len(template_contents), CHUNK_SIZE):
+                    count += len(update_translation_status(cms, template_contents[start:start + CHUNK_SIZE]))
+
+            self.stdout.write('%s: %s localized template contents' % (cms.name, count))
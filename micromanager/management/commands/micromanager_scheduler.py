@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from micromanager.publishing import BatchProgress, run_scheduled_publications
+
+import time
+
+
+class Command(BaseCommand):
+    help = 'Publishes and unpublishes template contents whose publish_at or unpublish_at is due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=60, help='seconds between two runs')
+        parser.add_argument('--once', action='store_true', help='run once, e.g. from cron')
+
+    def handle(self, *args, **options):
+
+        while True:
+            close_old_connections()
+
+            for progress in run_scheduled_publications():
+                if isinstance(progress, BatchProgress):
+                    if progress.errors:
+                        self.stderr.write(str(progress))
+                    else:
+                        self.stdout.write(str(progress))
+                else:
+                    self.stdout.write('%s unpublished' % progress.pk)
+
+            if options['once']:
+                break
+
+            time.sleep(options['interval'])
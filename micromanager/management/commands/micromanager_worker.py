@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from micromanager.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Runs the jobs of the micromanager job queue, see MICROMANAGER_JOB_QUEUE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=getattr(settings, 'MICROMANAGER_WORKER_THREADS', 2),
+                            help='number of jobs run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=1, dest='poll_interval',
+                            help='seconds to wait if there are no pending jobs')
+        parser.add_argument('--once', action='store_true', help='exit when there are no pending jobs')
+
+    def handle(self, *args, **options):
+        self.stdout.write('running jobs with %s threads' % options['threads'])
+        Worker(threads=options['threads'], poll_interval=options['poll_interval'], once=options['once']).run()
@@ -0,0 +1,305 @@
+"""
+    Content slot manifest
+    - precompiled list of all templates of a theme and the cms_* slots each template defines
+    - the admin forms, translation_complete and CMS.get_templates read the manifest instead of
+      parsing templates and listing directories at runtime
+    - built on first use in a process, or by 'manage.py micromanager_build_manifest'
+    - stored as MICROMANAGER_MANIFEST_DIR/<theme>/manifest.json, by default in a folder of the temp directory,
+      theme folders are often read-only; a manifest.json shipped in the theme folder is read if there is none
+    - the template sources are checked for modifications when a process loads a manifest and, in debug mode
+      (MICROMANAGER_THEME_RELOAD_INTERVAL), periodically afterwards, outdated manifests are rebuilt
+    - templates which fail to load are logged and skipped
+    - the stored translation status of template contents whose templates have changed slots is recomputed
+      after a rebuild, see micromanager.completeness
+
+    {
+        "version" : 2,
+        "theme" : "observatory",
+        "templates" : {
+            "pages" : ["pages/free_page.html", "pages/home.html"]
+        },
+        "slots" : {
+            "pages/home.html" : [
+                {"category" : "microcontent", "content_type" : "home_title", "multi" : false,
+                 "min" : 0, "max" : null, "args" : ["short"]}
+            ]
+        },
+        "sources" : {
+            "pages/home.html" : [["/path/to/templates/pages/home.html", 1486731253.0]]
+        }
+    }
+"""
+from django.conf import settings
+from django.template import loader
+
+import os, json, threading, time, tempfile, hashlib, logging
+
+from micromanager.CMSObjects import CMSTag
+from micromanager.middleware import theme_context
+from micromanager.themes import theme_registry
+
+# 2: slots of parent templates ({% extends %}) are no longer part of the child
+MANIFEST_VERSION = 2
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_DIR = getattr(settings, "MICROMANAGER_MANIFEST_DIR", None)
+
+logger = logging.getLogger(__name__)
+
+
+def get_manifest_path(theme_name):
+    if MANIFEST_DIR is not None:
+        return os.path.join(MANIFEST_DIR, theme_name, MANIFEST_FILENAME)
+
+    # keyed by the theme folder, deployments on the same host do not share their manifests
+    theme_path = theme_registry.get_theme_path(theme_name)
+    folder = hashlib.sha1(theme_path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), "micromanager-manifests", folder, theme_name, MANIFEST_FILENAME)
+
+
+# a prebuilt manifest shipped with the theme
+def get_theme_manifest_path(theme_name):
+    return os.path.join(theme_registry.get_theme_path(theme_name), MANIFEST_FILENAME)
+
+
+def slot_from_cms_tag(tag):
+    return {
+        "category" : tag.content_category,
+        "content_type" : tag.content_type,
+        "multi" : tag.multi,
+        "min" : tag.min_num,
+        "max" : tag.max_num,
+        "args" : list(tag.args),
+    }
+
+
+def cms_tag_from_slot(slot):
+    kwargs = {
+        "min" : slot["min"],
+        "max" : slot["max"],
+    }
+    return CMSTag(slot["category"], slot["content_type"], *slot["args"], **kwargs)
+
+
+def parse_template(template_name):
+    from micromanager.parser import TemplateParser
+
+    template = loader.get_template(template_name).template
+    parser = TemplateParser(template)
+    return parser.parse(), parser.dependencies
+
+
+class ThemeManifest(object):
+
+    def __init__(self, data, checked_at=None):
+        self.data = data
+        self.checked_at = checked_at or time.time()
+        self._cms_tags = {}
+
+    @property
+    def theme(self):
+        return self.data["theme"]
+
+    def get_template_names(self, template_type):
+        return list(self.data["templates"].get(template_type, []))
+
+    def get_slots(self, template_name):
+        return self.data["slots"].get(template_name, None)
+
+    def get_cms_tags(self, template_name):
+        slots = self.get_slots(template_name)
+
+        if slots is None:
+            return None
+
+        if template_name not in self._cms_tags:
+            self._cms_tags[template_name] = tuple(cms_tag_from_slot(slot) for slot in slots)
+
+        return list(self._cms_tags[template_name])
+
+    def is_fresh(self):
+        for template_name, sources in self.data["sources"].items():
+            for path, mtime in sources:
+                try:
+                    if os.path.getmtime(path) != mtime:
+                        return False
+                except OSError:
+                    return False
+
+        return True
+
+
+def build_manifest(theme_name):
+    from micromanager.loaders import get_theme_template_names
+
+    data = {
+        "version" : MANIFEST_VERSION,
+        "theme" : theme_name,
+        "templates" : {},
+        "slots" : {},
+        "sources" : {},
+    }
+
+    with theme_context(theme_name):
+        for template_name in get_theme_template_names(theme_name):
+
+            try:
+                cms_tags, dependencies = parse_template(template_name)
+            except Exception:
+                # e.g. TemplateSyntaxError, InvalidTemplateLibrary: the template cannot be rendered either
+                logger.exception("skipping %s of theme %s in the manifest" % (template_name, theme_name))
+                continue
+
+            if "/" in template_name:
+                template_type = template_name.split("/")[0]
+                data["templates"].setdefault(template_type, []).append(template_name)
+
+            data["slots"][template_name] = [slot_from_cms_tag(tag) for tag in cms_tags]
+            data["sources"][template_name] = [list(dependency) for dependency in dependencies]
+
+    return ThemeManifest(data)
+
+
+def write_manifest(manifest, manifest_path=None):
+    if manifest_path is None:
+        manifest_path = get_manifest_path(manifest.theme)
+
+    manifest_dir = os.path.dirname(manifest_path)
+    if not os.path.isdir(manifest_dir):
+        os.makedirs(manifest_dir)
+
+    tmp_path = "%s.%s.tmp" % (manifest_path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(manifest.data, f, indent=1, sort_keys=True)
+    os.rename(tmp_path, manifest_path)
+
+    return manifest_path
+
+
+def _read_manifest_file(manifest_path):
+    try:
+        with open(manifest_path, "r") as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+    if data.get("version", None) != MANIFEST_VERSION:
+        return None
+
+    return ThemeManifest(data)
+
+
+def read_manifest(theme_name):
+    manifest = _read_manifest_file(get_manifest_path(theme_name))
+
+    if manifest is None:
+        manifest = _read_manifest_file(get_theme_manifest_path(theme_name))
+
+    return manifest
+
+
+# the templates whose slots differ, None if there is no previous manifest
+def get_changed_templates(previous, manifest):
+    if previous is None:
+        return None
+
+    template_names = set(previous.data["slots"].keys()) | set(manifest.data["slots"].keys())
+
+    return sorted([template_name for template_name in template_names
+                   if previous.get_slots(template_name) != manifest.get_slots(template_name)])
+
+
+def manifest_rebuilt(theme_name, previous, manifest):
+    from micromanager.completeness import template_slots_changed
+
+    template_names = get_changed_templates(previous, manifest)
+
+    if template_names != []:
+        template_slots_changed(theme_name, template_names)
+
+
+class ManifestRegistry(object):
+
+    def __init__(self, reload_interval=None):
+        self.reload_interval = reload_interval
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    def _needs_rebuild(self, manifest):
+        if self.reload_interval is None:
+            return False
+
+        now = time.time()
+        if now - manifest.checked_at < self.reload_interval:
+            return False
+
+        manifest.checked_at = now
+        return not manifest.is_fresh()
+
+    def _build(self, theme_name):
+        manifest = build_manifest(theme_name)
+        try:
+            write_manifest(manifest)
+        except (IOError, OSError):
+            # not writable, keep the manifest in memory
+            logger.warning("the manifest of theme %s could not be written to %s" % (
+                theme_name, get_manifest_path(theme_name)))
+        return manifest
+
+    # load a manifest from disk, (re)build it if it is missing or outdated
+    def load(self, theme_name, check_sources=True):
+        previous = read_manifest(theme_name)
+        manifest = previous
+
+        if manifest is None or (check_sources and not manifest.is_fresh()):
+            manifest = self._build(theme_name)
+
+        with self._lock:
+            self._manifests[theme_name] = manifest
+
+        # the translation status reads the manifest from the registry, it is stored first
+        if manifest is not previous:
+            manifest_rebuilt(theme_name, previous, manifest)
+
+        return manifest
+
+    def get_manifest(self, theme_name):
+        manifest = self._manifests.get(theme_name, None)
+
+        if manifest is None:
+            # the templates may have been deployed after the manifest has been written
+            manifest = self.load(theme_name)
+
+        elif self._needs_rebuild(manifest):
+            previous = manifest
+            with self._lock:
+                manifest = self._build(theme_name)
+                self._manifests[theme_name] = manifest
+
+            manifest_rebuilt(theme_name, previous, manifest)
+
+        return manifest
+
+    def clear(self):
+        with self._lock:
+            self._manifests = {}
+
+
+manifest_registry = ManifestRegistry(reload_interval=theme_registry.reload_interval)
+
+
+def get_manifest(theme_name):
+    return manifest_registry.get_manifest(theme_name)
+
+
+"""
+    the CMSTags of a template, read from the manifest
+    templates that are not part of the theme folder (e.g. app templates) are parsed
+"""
+def get_cms_tags(theme_name, template_name):
+    cms_tags = get_manifest(theme_name).get_cms_tags(template_name)
+
+    if cms_tags is None:
+        with theme_context(theme_name):
+            cms_tags, dependencies = parse_template(template_name)
+
+    return cms_tags
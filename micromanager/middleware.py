@@ -1,19 +1,28 @@
 from django.conf import settings
 from django.core.exceptions import SuspiciousFileOperation
-import threading
+import threading, copy
+from contextlib import contextmanager
 try:
     from django.urls import reverse
 except:
     from django.core.urlresolvers import reverse
 from django.shortcuts import redirect
+from django.http import Http404
+from django.http.request import split_domain_port
+from django.db import DatabaseError
 
-from micromanager.models import INSTALLED_THEMES, CMS
+from micromanager.models import CMS, CMSDomain
+from micromanager.cache import resolution_cache
+from micromanager.themes import theme_registry
+from micromanager.surrogate import get_surrogate_keys, set_surrogate_key_header, cms_key
+from micromanager.pagecache import is_public_request
+from micromanager.dependencies import dependency_index, get_canonical_path
 
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
-DEFAULT_THEME = INSTALLED_THEMES[0][0]
 MULTI_TENANCY = getattr(settings, "MICROMANAGER_MULTI_TENANCY", False)
+RECORD_DEPENDENCIES = getattr(settings, "MICROMANAGER_RECORD_DEPENDENCIES", True)
 
 
 _thread_local = threading.local()
@@ -25,44 +34,120 @@ else:
     MiddlewareMixin = object
 
 
+"""
+    host -> CMS lookup table for multi tenancy
+    - kept in the resolution cache, so it is reloaded in every process after a CMSDomain has changed
+"""
+def get_domain_map():
+    def load():
+        return dict((cms_domain.domain, cms_domain.cms) for cms_domain in CMSDomain.objects.select_related("cms"))
+
+    return resolution_cache.get("domains", load)
+
+
+def get_request_domain(request):
+    domain, port = split_domain_port(request.get_host())
+    return domain
+
+
+def get_cms_for_domain(domain):
+    return get_domain_map().get(domain.lower(), None)
+
+
 """
     Add request.cms
 """
 class MicroManagerMiddleware(MiddlewareMixin):
 
+    def __init__(self, *args, **kwargs):
+        super(MicroManagerMiddleware, self).__init__(*args, **kwargs)
+
+        # preload the lookup table when the worker starts
+        if MULTI_TENANCY == True:
+            try:
+                get_domain_map()
+            except DatabaseError:
+                # e.g. the tables do not exist yet
+                resolution_cache.clear()
+
     def process_request(self, request):
 
         if 'micromanager-setup' in request.path:
             return None
 
-        if not User.objects.filter(is_superuser=True).exists():
+        has_superuser = resolution_cache.get("has_superuser",
+                                             lambda: User.objects.filter(is_superuser=True).exists())
+        if not has_superuser:
             return redirect(reverse('micromanager_create_admin'))
 
         if not hasattr(request, "cms") or request.cms is None:
         
             if MULTI_TENANCY == True:
-                raise ValueError("Multi Tenancy not supported yet")
+                cms = get_cms_for_domain(get_request_domain(request))
+
+                if not cms:
+                    if not resolution_cache.get("cms", lambda: CMS.objects.all().first()):
+                        return redirect(reverse('micromanager_setup'))
+                    raise Http404("No CMS is configured for this domain")
 
             else:
-                cms = CMS.objects.all().first()
+                cms = resolution_cache.get("cms", lambda: CMS.objects.all().first())
 
                 if not cms:
                     return redirect(reverse('micromanager_setup'))
-                    
-            request.cms = cms
+
+            # the cached instance is shared between requests, hand out a copy
+            request.cms = copy.copy(cms)
 
         request.cms_language = request.cms.get_language()
 
         return None
+
+    # surrogate keys collected while rendering, see micromanager.surrogate
+    def process_response(self, request, response):
+        keys = get_surrogate_keys(request)
+
+        if keys:
+            keys.add(cms_key(request.cms.pk))
+            set_surrogate_key_header(response, keys)
+
+            if RECORD_DEPENDENCIES == True and response.status_code == 200 and is_public_request(request):
+                path = get_canonical_path(request)
+                if path is not None:
+                    dependency_index.record(request.cms.pk, path, keys)
+
+        return response
         
 
 
 
+def get_default_theme():
+    theme_names = theme_registry.get_theme_names()
+    if theme_names:
+        return theme_names[0]
+    return None
+
+
 def get_current_theme():
-    theme = getattr(_thread_local, 'theme', DEFAULT_THEME)
+    theme = getattr(_thread_local, 'theme', None)
+    if theme is None:
+        theme = get_default_theme()
     return theme
 
 
+"""
+    render with a given theme outside of a request, e.g. in management commands
+"""
+@contextmanager
+def theme_context(theme):
+    previous_theme = getattr(_thread_local, 'theme', None)
+    _thread_local.theme = theme
+    try:
+        yield theme
+    finally:
+        _thread_local.theme = previous_theme
+
+
 class ThemeMiddleware(MiddlewareMixin):
 
     # make request available for template loader
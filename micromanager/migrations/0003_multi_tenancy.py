@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_cms(apps, schema_editor):
+    CMS = apps.get_model('micromanager', 'CMS')
+
+    # global content existed before multi tenancy, it belongs to the first cms
+    first_cms = CMS.objects.all().order_by('pk').first()
+
+    for model_name in ['MicroContent', 'ContentImages']:
+        Model = apps.get_model('micromanager', model_name)
+
+        for instance in Model.objects.filter(cms__isnull=True).select_related('template_content'):
+            if instance.template_content is not None:
+                instance.cms_id = instance.template_content.cms_id
+            elif first_cms is not None:
+                instance.cms_id = first_cms.pk
+            else:
+                continue
+            instance.save(update_fields=['cms'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0002_templatecontent_is_home_page'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CMSDomain',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(max_length=255, unique=True)),
+                ('cms', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='micromanager.CMS')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='contentimages',
+            name='cms',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='micromanager.CMS'),
+        ),
+        migrations.AddField(
+            model_name='microcontent',
+            name='cms',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='micromanager.CMS'),
+        ),
+        migrations.RunPython(assign_cms, migrations.RunPython.noop),
+    ]
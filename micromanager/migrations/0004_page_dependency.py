@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0003_multi_tenancy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageDependency',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('key', models.CharField(max_length=255)),
+                ('cms', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='micromanager.CMS')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pagedependency',
+            unique_together=set([('cms', 'path', 'key')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='pagedependency',
+            index_together=set([('cms', 'key')]),
+        ),
+    ]
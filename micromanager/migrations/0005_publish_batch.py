@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:56
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('micromanager', '0004_page_dependency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishBatch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(default='all', max_length=5)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('finished', 'Finished')], default='pending', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('total', models.IntegerField(default=0)),
+                ('published_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PublishBatchItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('published', 'Published'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('errors', models.TextField(null=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='micromanager.PublishBatch')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='publishbatchitem',
+            name='template_content',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='micromanager.TemplateContent'),
+        ),
+        migrations.AddField(
+            model_name='publishbatch',
+            name='cms',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='micromanager.CMS'),
+        ),
+        migrations.AddField(
+            model_name='publishbatch',
+            name='created_by',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterIndexTogether(
+            name='publishbatchitem',
+            index_together=set([('batch', 'status', 'position')]),
+        ),
+    ]
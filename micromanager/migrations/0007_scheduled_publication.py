@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0006_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='templatecontent',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='templatecontent',
+            name='unpublish_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0007_scheduled_publication'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranslationStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slots_required', models.IntegerField(default=0)),
+                ('slots_filled', models.IntegerField(default=0)),
+                ('ready', models.BooleanField(default=False)),
+                ('dirty', models.BooleanField(default=True)),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+                ('localized_template_content', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='translation_status', to='micromanager.LocalizedTemplateContent')),
+            ],
+        ),
+    ]
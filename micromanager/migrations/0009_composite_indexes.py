@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:04
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# global content, (name, table, columns, condition), only created on backends with partial indexes
+PARTIAL_INDEXES = [
+    ('micromanager_mc_global', 'micromanager_microcontent', 'cms_id, content_type', 'template_content_id IS NULL'),
+    ('micromanager_ci_global', 'micromanager_contentimages', 'cms_id, content_type', 'template_content_id IS NULL'),
+]
+
+PARTIAL_INDEX_VENDORS = ['postgresql', 'sqlite']
+
+
+def create_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+
+    for name, table, columns, condition in PARTIAL_INDEXES:
+        schema_editor.execute('CREATE INDEX %s ON %s (%s) WHERE %s' % (name, table, columns, condition))
+
+
+def drop_partial_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+        return
+
+    for name, table, columns, condition in PARTIAL_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0008_translation_status'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='contentimages',
+            index_together=set([('template_content', 'content_type')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='localizedtemplatecontent',
+            index_together=set([('template_content', 'language')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='microcontent',
+            index_together=set([('template_content', 'content_type')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='templatecontent',
+            index_together=set([('cms', 'template_name', 'published_at'), ('cms', 'is_home_page')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='templatecontenttypes',
+            index_together=set([('content_type', 'position')]),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:08
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0009_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishedContent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=5)),
+                ('document', models.TextField()),
+                ('last_modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='publishedcontent',
+            name='cms',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='micromanager.CMS'),
+        ),
+        migrations.AddField(
+            model_name='publishedcontent',
+            name='template_content',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='micromanager.TemplateContent'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='publishedcontent',
+            unique_together=set([('cms', 'template_content', 'language')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0010_published_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cms',
+            name='global_content_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+    ]
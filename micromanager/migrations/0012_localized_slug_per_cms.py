@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_cms(apps, schema_editor):
+    LocalizedTemplateContent = apps.get_model("micromanager", "LocalizedTemplateContent")
+    TemplateContent = apps.get_model("micromanager", "TemplateContent")
+
+    for cms_id in TemplateContent.objects.values_list("cms_id", flat=True).distinct():
+        LocalizedTemplateContent.objects.filter(template_content__cms_id=cms_id).update(cms_id=cms_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0011_global_content_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='localizedtemplatecontent',
+            name='cms',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='micromanager.CMS'),
+        ),
+        migrations.RunPython(set_cms, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='localizedtemplatecontent',
+            name='cms',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='micromanager.CMS'),
+        ),
+        migrations.AlterField(
+            model_name='localizedtemplatecontent',
+            name='slug',
+            field=models.SlugField(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='localizedtemplatecontent',
+            unique_together=set([('cms', 'language', 'slug')]),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('micromanager', '0012_localized_slug_per_cms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publishbatch',
+            name='scheduled',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='publishbatch',
+            index_together=set([('scheduled', 'status')]),
+        ),
+    ]
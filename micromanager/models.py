@@ -4,7 +4,7 @@
     MICROMANAGER - template first content management
 """
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.contenttypes.fields import GenericRelation
 from django.conf import settings
 from django.apps import apps
@@ -30,35 +30,13 @@ from datetime import datetime
 
 from micromanager.widgets import MultiContentWidget
 from micromanager.fields import MultiContentField
+from micromanager.cache import resolution_cache
+from micromanager.themes import theme_registry, LazyThemeChoices
 
 from django.utils.safestring import mark_safe
 
 
-def _get_themes_root():
-    micromanagerpath = os.path.dirname(os.path.realpath(__file__))
-    return os.path.join(micromanagerpath, "themes")
-
-def _get_themes():
-
-    themes_path = _get_themes_root()
-
-    themes = []
-
-    # iterate over all folders
-    for root, dirs, files in os.walk(themes_path):
-        for d in dirs:
-            settings_file = os.path.join(root, d, "settings.json")
-
-            if os.path.isfile(settings_file):
-                with open(settings_file, "r") as f:
-                    settings = json.load(f)
-
-                theme = (d, settings["name"])
-                themes.append(theme)
-
-    return themes
-
-INSTALLED_THEMES = _get_themes()
+INSTALLED_THEMES = LazyThemeChoices()
 
 class CMSManager(models.Manager):
     
@@ -83,14 +61,35 @@ class CMSManager(models.Manager):
 class CMS(models.Model):
     name = models.CharField(max_length=100)
     theme = models.CharField(max_length=255, choices=INSTALLED_THEMES)
+    # bumped whenever global content changes, see micromanager.cache.get_global_content_cache
+    global_content_version = models.IntegerField(default=0, editable=False)
 
     objects = CMSManager()
 
+    # the version is only changed with UPDATE ... SET global_content_version + 1, a CMS instance from the
+    # resolution cache must not write back an old value
+    def save(self, *args, **kwargs):
+        if self.pk is not None and not kwargs.get("force_insert", False) and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != "global_content_version"]
+        return super(CMS, self).save(*args, **kwargs)
+
+    # (language, is_primary) tuples, served from the process wide resolution cache
+    def language_set(self):
+        def load():
+            return tuple(CMSLanguages.objects.filter(cms=self).values_list("language", "is_primary"))
+
+        return resolution_cache.get(("languages", self.pk), load)
+
     def primary_language(self):
-        return CMSLanguages.objects.get(cms=self, is_primary=True).language
+        for language, is_primary in self.language_set():
+            if is_primary:
+                return language
+
+        raise CMSLanguages.DoesNotExist("CMS %s has no primary language" % self.pk)
 
     def secondary_languages(self):
-        languages = list(CMSLanguages.objects.filter(cms=self, is_primary=False).values_list("language", flat=True))
+        languages = [language for language, is_primary in self.language_set() if not is_primary]
         return languages
 
     def languages(self):
@@ -105,51 +104,46 @@ class CMS(models.Model):
         else:
             locale = "en"
 
-        languages = CMSLanguages.objects.filter(cms=self)
+        languages = [language for language, is_primary in self.language_set()]
 
-        if locale in languages.values_list("language", flat=True):
+        if locale in languages:
             return locale
         else:
-            return languages.get(is_primary=True).language
+            return self.primary_language()
 
         
+    # read-only settings, shared by all callers
     def load_theme_settings(self):
-        theme_settings = {}
-        
-        settings_path = os.path.join(_get_themes_root(), self.theme, "settings.json")
-
-        if os.path.isfile(settings_path):
-            with open(settings_path, "r") as f:
-                theme_settings = json.loads(f.read())
-
-        return theme_settings
+        try:
+            return theme_registry.get_settings(self.theme)
+        except FileNotFoundError:
+            return {}
 
 
     def get_theme_path(self):
-        return os.path.join(_get_themes_root(), self.theme)
+        return theme_registry.get_theme_path(self.theme)
 
 
     def get_templates_path(self):
         return os.path.join(self.get_theme_path(), "templates")
 
     def delete(self, *args, **kwargs):
-        folder = os.path.join(settings.MEDIA_ROOT, 'micromanager', str(self.pk))
-        if os.path.isdir(folder):
-            shutil.rmtree(folder)
+        from micromanager.jobs import remove_path
+        # the uploaded files of a cms can be many, they are removed by a job if MICROMANAGER_JOB_QUEUE is True
+        remove_path(os.path.join(settings.MEDIA_ROOT, 'micromanager', str(self.pk)))
         return super(CMS, self).delete(*args, **kwargs)
 
 
     def get_templates(self, template_type):
+        from .manifest import get_manifest
 
-        templates_path = os.path.join(self.get_templates_path(), template_type)
         settings = self.load_theme_settings()
         language = self.get_language()
 
         templates = []
     
-        for filename in os.listdir(templates_path):
+        for template_path in get_manifest(self.theme).get_template_names(template_type):
 
-            template_path = "%s/%s" % (template_type, filename)
             verbose_name = template_path
 
             if template_path in settings['verbose_template_names'] and language in settings['verbose_template_names'][template_path]:
@@ -167,6 +161,22 @@ class CMS(models.Model):
         return self.get_templates('content')
 
 
+"""
+    hosts a CMS is served on, only used if MICROMANAGER_MULTI_TENANCY is True
+    - the domain is stored without port, e.g. 'www.example.com'
+"""
+class CMSDomain(models.Model):
+    domain = models.CharField(max_length=255, unique=True)
+    cms = models.ForeignKey(CMS)
+
+    def save(self, *args, **kwargs):
+        self.domain = self.domain.lower()
+        return super(CMSDomain, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return self.domain
+
+
 # the languages the website supports
 class CMSLanguages(models.Model):
     language = models.CharField(max_length=15, choices=settings.LANGUAGES) # length like in django_parler
@@ -229,9 +239,18 @@ class TemplateContent(models.Model):
     published_version = models.IntegerField(null=True)
     published_at = models.DateTimeField(null=True)
     is_home_page = models.BooleanField(default=False)
+    # scheduled publication, see micromanager.publishing.run_scheduled_publications
+    publish_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    unpublish_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     objects = TemplateContentManager()
 
+    class Meta:
+        index_together = [
+            ["cms", "template_name", "published_at"],
+            ["cms", "is_home_page"],
+        ]
+
     def verbose_template_name(self):
         language = self.cms.get_language()
         settings = self.cms.load_theme_settings()
@@ -245,6 +264,10 @@ class TemplateContent(models.Model):
         
 
     def get_localized(self, language):
+        # set by micromanager.completeness.prefetch_translation_status
+        if hasattr(self, "_prefetched_locales"):
+            return self._prefetched_locales.get(language, None)
+
         localized_template_content = LocalizedTemplateContent.objects.filter(template_content=self, language=language).first()
         return localized_template_content
 
@@ -259,51 +282,40 @@ class TemplateContent(models.Model):
         return t.template
 
     def primary_title(self):
-        locale = LocalizedTemplateContent.objects.filter(template_content=self, language=self.cms.primary_language()).first()
+        locale = self.get_localized(self.cms.primary_language())
 
         if locale:
             return locale.title
         else:
             return None
 
-    def translation_complete(self):
-        for language in self.cms.languages():
-            lp = LocalizedTemplateContent.objects.filter(template_content=self, language=language.language).first()
+    # see micromanager.completeness
+    def get_incomplete_languages(self):
+        # set by micromanager.completeness.prefetch_translation_status
+        if hasattr(self, "_incomplete_languages"):
+            return self._incomplete_languages
 
-            if not lp:
-                return False
+        from .completeness import get_incomplete_languages
+        return get_incomplete_languages(self)
 
-            if not lp.translation_ready:
-                return False
-
-            if not lp.translation_complete():
-                return False
-            
-        return True
+    def translation_complete(self, language=None):
+        if language is not None:
+            return language not in self.get_incomplete_languages()
+        return not self.get_incomplete_languages()
 
 
+    # see micromanager.publishing, returns the list of publication errors
     def publish(self, language="all"):
+        from .publishing import publish_template_content
 
-        publication_errors = []
-        
-        if not self.translation_complete():
-            publication_errors.append(_("The texts of this content or its translations (if any) are not yet complete."))
-
-        # below this, no error checks are allowed because published_versions are being set
+        result = publish_template_content(self, language=language)
 
-        if not publication_errors:
-
-            if language == "all":
-                lps = LocalizedTemplateContent.objects.filter(template_content=self)
-            else:
-                lps = [LocalizedTemplateContent.objects.get(template_content=template_content, language=language)]
+        if result.published:
+            self.draft_version = result.template_content.draft_version
+            self.published_version = result.template_content.published_version
+            self.published_at = result.template_content.published_at
 
-            for lp in lps:
-                lp.save(publish=True)
-
-            self.save(publish=True)
-
-        return publication_errors
+        return result.errors
     
 
     def types(self):
@@ -331,42 +343,54 @@ class TemplateContent(models.Model):
         super(TemplateContent, self).save(*args, **kwargs)
 
 
+SLUG_MAX_LENGTH = 30
+# the longest numeric suffix covered by the prefix query of generate_slug
+SLUG_SUFFIX_LENGTH = 5
+SLUG_RETRIES = 5
+
 class LocalizedTemplateContentManager(models.Manager):
 
     def create(self, creator, template_content, language, title):
-        
-        slug = self.generate_slug(title)
 
         localized_template_content = self.model(
             creator = creator,
+            cms_id = template_content.cms_id,
             template_content = template_content,
             language = language,
             title = title,
-            slug = slug,
         )
-        
-        localized_template_content.save()
+
+        # a concurrent request may take the slug between generating and saving it, the unique index decides
+        for attempt in range(SLUG_RETRIES):
+            localized_template_content.slug = self.generate_slug(title, template_content.cms_id, language)
+
+            try:
+                with transaction.atomic():
+                    localized_template_content.save()
+                break
+            except IntegrityError:
+                if attempt == SLUG_RETRIES - 1 or not self.filter(cms_id=template_content.cms_id, language=language,
+                                                                  slug=localized_template_content.slug).exists():
+                    raise
 
         return localized_template_content
 
 
-    def generate_slug(self, title):
-        max_len = 30
-        slug_base = str('%s' % (slugify(title)) )[:max_len-1]
+    # slug, slug2, slug3, ... - all taken slugs of the cms and language are fetched with one prefix query
+    def generate_slug(self, title, cms_id, language):
+        slug_base = str('%s' % (slugify(title)) )[:SLUG_MAX_LENGTH-1]
 
-        slug = slug_base
+        taken = set(LocalizedTemplateContent.objects.filter(cms_id=cms_id, language=language,
+            slug__startswith=slug_base[:SLUG_MAX_LENGTH-SLUG_SUFFIX_LENGTH]).values_list("slug", flat=True))
 
-        exists = LocalizedTemplateContent.objects.filter(slug=slug).exists()
+        slug = slug_base
 
         i = 2
-        while exists:
-            
-            if len(slug) > max_len:
-                slug_base = slug_base[:-1]
-                
-            slug = str('%s%s' % (slug_base, i))
+        while slug in taken:
+            suffix = str(i)
+            # long slugs are shortened to make room for the suffix
+            slug = str('%s%s' % (slug_base[:SLUG_MAX_LENGTH-len(suffix)], suffix))
             i += 1
-            exists = LocalizedTemplateContent.objects.filter(slug=slug).exists()
 
         return slug
 
@@ -374,8 +398,9 @@ class LocalizedTemplateContentManager(models.Manager):
     translation_ready is set by the translator to signal that he has finished the translation
 """
 class LocalizedTemplateContent(models.Model):
+    cms = models.ForeignKey(CMS) # the cms of template_content, slugs are unique per cms and language
     template_content = models.ForeignKey(TemplateContent)
-    slug = models.SlugField(unique=True)# localized slug
+    slug = models.SlugField()# localized slug
     language = models.CharField(max_length=5, choices=settings.LANGUAGES)
     title = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -390,36 +415,31 @@ class LocalizedTemplateContent(models.Model):
 
     objects = LocalizedTemplateContentManager()
 
-    def save(self, *args, **kwargs):
-
-        publish = kwargs.pop("publish", False)
-
-        if publish:
-            
-            microcontents = MicroContent.objects.filter(template_content=self.template_content)
-            for mc in microcontents:
-                mc.publish(self.language)
+    class Meta:
+        unique_together = ("cms", "language", "slug")
+        index_together = [
+            ["template_content", "language"],
+        ]
 
-            content_images = ContentImages.objects.filter(template_content=self.template_content)
-            for cimg in content_images:
-                cimg.publish(self.language)
+    def save(self, *args, **kwargs):
 
-            self.published_version = self.template_content.draft_version
+        if self.cms_id is None:
+            self.cms_id = self.template_content.cms_id
 
-        else:
-            # the template_content has been published
-            # all localized template_contents and the template_content have the same published_version
-            # AND the localized template_contents and the template_content have the same draft_version
-            if self.published_version == self.template_content.published_version:
+        # publishing is done by micromanager.publishing, which updates the published_version
+        # the template_content has been published
+        # all localized template_contents and the template_content have the same published_version
+        # AND the localized template_contents and the template_content have the same draft_version
+        if self.published_version == self.template_content.published_version:
 
-                # check if the template_contents draft version has to be increased
-                if self.template_content.draft_version == self.template_content.published_version:
-                    self.template_content.draft_version += 1
-                    self.template_content.save()
+            # check if the template_contents draft version has to be increased
+            if self.template_content.draft_version == self.template_content.published_version:
+                self.template_content.draft_version += 1
+                self.template_content.save()
 
-                if self.draft_version == self.published_version:
-                    self.draft_version = self.template_content.draft_version
-                    self.translation_ready = False
+            if self.draft_version == self.published_version:
+                self.draft_version = self.template_content.draft_version
+                self.translation_ready = False
 
         super(LocalizedTemplateContent, self).save(*args, **kwargs)
 
@@ -428,34 +448,9 @@ class LocalizedTemplateContent(models.Model):
         return MicroContent.objects.filter(template_content=self.template_content, content_type=content_type)
 
 
+    # see micromanager.completeness, the stored translation status is the only source
     def translation_complete(self):
-
-        if not self.translation_ready:
-            return False
-
-        if self.draft_version != self.template_content.draft_version:
-            return False
-        
-        # load the parser
-        from .parser import TemplateParser
-        parser = TemplateParser(self.template_content.get_template())
-
-        cms_tags = parser.parse()
-
-        for tag in cms_tags:
-            if not "optional" in tag.args:
-                
-                content = tag.Model.objects.filter(template_content=self.template_content, content_type=tag.content_type).first()
-
-                if not content:
-                    return False
-
-                else:
-                    complete = content.translation_complete(self.language, tag)
-                    if not complete:
-                        return False
-        
-        return True
+        return self.template_content.translation_complete(self.language)
 
     def types(self):
         return self.template_content.types()
@@ -472,6 +467,9 @@ class TemplateContentTypes(models.Model):
 
     class Meta:
         unique_together = ("template_content", "content_type")
+        index_together = [
+            ["content_type", "position"],
+        ]
 
 
 """
@@ -496,6 +494,7 @@ class CMSMicroContentManager(models.Manager):
     - the content has to remain in the db until he publishes the new version
 """
 class CMSMicroContent(models.Model):
+    cms = models.ForeignKey(CMS, null=True) # scopes global content to its tenant
     template_content = models.ForeignKey(TemplateContent, null=True) # if template_content is None, it is the same content for every template_content
     deleted = models.BooleanField(default=False)
     deleted_in_template_content_version = models.IntegerField(null=True)
@@ -524,11 +523,14 @@ class CMSMicroContent(models.Model):
 
 
     def save(self):
-        self.template_content.save()
+        if self.template_content is not None:
+            if self.cms_id is None:
+                self.cms_id = self.template_content.cms_id
+            self.template_content.save()
         super(CMSMicroContent, self).save()
 
     def delete(self, *args, **kwargs):
-        if self.template_content.published_version == None or self.template_content.published_version > self.deleted_in_template_content_version: 
+        if self.template_content is None or self.template_content.published_version == None or self.template_content.published_version > self.deleted_in_template_content_version: 
             super(CMSMicroContent, self).delete(*args, **kwargs)
         else:
             self.deleted = True
@@ -536,8 +538,12 @@ class CMSMicroContent(models.Model):
             self.save()
             
 
+    # global content (template_content is NULL) has a partial index on (cms, content_type), see migration 0009
     class Meta:
         abstract = True
+        index_together = [
+            ["template_content", "content_type"],
+        ]
 
     
 """
@@ -552,6 +558,7 @@ class MicroContentManager(CMSMicroContentManager):
     def create(self, template_content, language, content_type, content, editor, **kwargs):
 
         microcontent = self.model(
+            cms = kwargs.get("cms", None),
             template_content = template_content,
             content_type = content_type,
         )
@@ -589,7 +596,7 @@ class MicroContent(CMSMicroContent):
 
     def get_content(self, language, draft=False):
 
-        lmc = LocalizedMicroContent.objects.filter(microcontent=self, language=language).first()
+        lmc = self.get_localized(language)
 
         if lmc:
             if draft == True:
@@ -602,6 +609,11 @@ class MicroContent(CMSMicroContent):
 
 
     def get_localized(self, language):
+        # ContentBundle prefetches the localized content of all microcontents of a page
+        prefetched = getattr(self, "_prefetched_localized", None)
+        if prefetched is not None and language in prefetched:
+            return prefetched[language]
+
         return LocalizedMicroContent.objects.filter(microcontent=self, language=language).first()
 
 
@@ -719,6 +731,7 @@ class ContentImagesManager(CMSMicroContentManager):
     def create(self, template_content, language, content_type, content, editor, **kwargs):
 
         microcontent = self.model(
+            cms = kwargs.get("cms", None),
             template_content = template_content,
             content_type = content_type,
             draft_content = content,
@@ -739,6 +752,8 @@ def content_images_upload_path(instance, filename):
 
     if hasattr(instance, "template_content") and instance.template_content is not None:
         subfolder = str(instance.template_content.cms.pk)
+    elif getattr(instance, "cms_id", None) is not None:
+        subfolder = str(instance.cms_id)
     else:
         subfolder = "global"
 
@@ -752,6 +767,8 @@ def content_images_publication_path(instance, filename):
 
     if hasattr(instance, "template_content") and instance.template_content is not None:
         subfolder = str(instance.template_content.cms.pk)
+    elif getattr(instance, "cms_id", None) is not None:
+        subfolder = str(instance.cms_id)
     else:
         subfolder = "global"
 
@@ -776,7 +793,7 @@ class ContentImages(CMSMicroContent):
         if not self.published_content:
             self.published_content.save(
                 content_images_publication_path(self, os.path.basename(self.draft_content.name)),
-                File(open(self.draft_content.path, "r"))
+                File(open(self.draft_content.path, "rb"))
             )
             self.save()
 
@@ -811,14 +828,162 @@ class ContentImages(CMSMicroContent):
         self.save()
 
         if old_filepath != self.draft_content.path:
-            if os.path.isfile(old_filepath):
-                os.remove(old_filepath)
+            from micromanager.jobs import remove_path
+            remove_path(old_filepath)
 
     def translation_complete(self, language, tag):
         return True
 
 
 
+"""
+    dependency index: which public page (path) of a cms shows what, one row per (page, surrogate key)
+    - recorded while rendering, see micromanager.dependencies
+"""
+class PageDependency(models.Model):
+    cms = models.ForeignKey(CMS)
+    path = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ("cms", "path", "key")
+        index_together = [
+            ["cms", "key"],
+        ]
+
+
+"""
+    translation completeness of a LocalizedTemplateContent, maintained on write, see micromanager.completeness
+"""
+class TranslationStatus(models.Model):
+    localized_template_content = models.OneToOneField(LocalizedTemplateContent, on_delete=models.CASCADE,
+                                                      related_name="translation_status")
+    slots_required = models.IntegerField(default=0)
+    slots_filled = models.IntegerField(default=0)
+    ready = models.BooleanField(default=False) # translation_ready and up to date with the draft
+    dirty = models.BooleanField(default=True) # not published or new changes
+    last_modified = models.DateTimeField(auto_now=True)
+
+    @property
+    def complete(self):
+        return self.ready and self.slots_filled >= self.slots_required
+
+
+"""
+    read model of the public site, see micromanager.content
+    - one document per published page and language with the published content of its microcontents and images,
+      written when the page is published
+    - the document of the global content of a cms has no template_content, it is rebuilt after global content
+      has been changed
+"""
+class PublishedContent(models.Model):
+    cms = models.ForeignKey(CMS)
+    template_content = models.ForeignKey(TemplateContent, null=True) # None: global content of the cms
+    language = models.CharField(max_length=5)
+    document = models.TextField()
+    last_modified = models.DateTimeField(auto_now=True)
+
+    def get_document(self):
+        return json.loads(self.document)
+
+    class Meta:
+        unique_together = ("cms", "template_content", "language")
+
+
+"""
+    batch publication of many template contents, see micromanager.publishing
+    - every template content of a batch is an item, items are marked published or failed as soon as they are done
+    - an interrupted batch is resumed by running its pending items
+    - scheduled batches are created by the scheduler, which resumes them if it has been interrupted
+"""
+PUBLISH_BATCH_STATUS = (
+    ('pending', _('Pending')),
+    ('running', _('Running')),
+    ('finished', _('Finished')),
+)
+
+class PublishBatch(models.Model):
+    cms = models.ForeignKey(CMS)
+    language = models.CharField(max_length=5, default="all")
+    status = models.CharField(max_length=20, choices=PUBLISH_BATCH_STATUS, default="pending")
+    created_at = models.DateTimeField(auto_now_add=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True)
+    finished_at = models.DateTimeField(null=True)
+    total = models.IntegerField(default=0)
+    published_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    scheduled = models.BooleanField(default=False) # created for TemplateContent.publish_at
+
+    class Meta:
+        index_together = [
+            ["scheduled", "status"],
+        ]
+
+
+PUBLISH_BATCH_ITEM_STATUS = (
+    ('pending', _('Pending')),
+    ('published', _('Published')),
+    ('failed', _('Failed')),
+)
+
+class PublishBatchItem(models.Model):
+    batch = models.ForeignKey(PublishBatch)
+    template_content = models.ForeignKey(TemplateContent, null=True, on_delete=models.SET_NULL)
+    position = models.IntegerField()
+    status = models.CharField(max_length=20, choices=PUBLISH_BATCH_ITEM_STATUS, default="pending")
+    errors = models.TextField(null=True) # json list of error messages
+
+    def get_errors(self):
+        if self.errors:
+            return json.loads(self.errors)
+        return []
+
+    class Meta:
+        index_together = [
+            ["batch", "status", "position"],
+        ]
+
+
+"""
+    background jobs, see micromanager.jobs
+    - payload and result are json, a job is claimed by one worker by setting its status to running
+"""
+JOB_STATUS = (
+    ('pending', _('Pending')),
+    ('running', _('Running')),
+    ('finished', _('Finished')),
+    ('failed', _('Failed')),
+)
+
+class Job(models.Model):
+    cms = models.ForeignKey(CMS, null=True, on_delete=models.SET_NULL)
+    kind = models.CharField(max_length=100)
+    payload = models.TextField(default="{}")
+    status = models.CharField(max_length=20, choices=JOB_STATUS, default="pending")
+    result = models.TextField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+
+    def get_payload(self):
+        return json.loads(self.payload)
+
+    def get_result(self):
+        if self.result:
+            return json.loads(self.result)
+        return {}
+
+    @property
+    def done(self):
+        return self.status in ["finished", "failed"]
+
+    class Meta:
+        index_together = [
+            ["status", "created_at"],
+        ]
+
+
 def _generate_plaintext(text):
     text = strip_tags(text)
     return ' '.join(text.split())
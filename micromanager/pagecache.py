@@ -0,0 +1,110 @@
+"""
+    Full page cache for published pages
+    - enabled by setting MICROMANAGER_PAGE_CACHE to the alias of a django cache, disabled by default
+    - the key contains everything the published output depends on:
+        cms, theme, localized template content (and its last modification), section, language,
+        published_version of the template content, global content version and navigation version of the cms
+    - nothing is ever deleted: publishing a page changes its published_version and thus only its own key,
+      changes to global content or navigations bump the version of their cms once committed, old entries expire
+    - previews (?preview=1) and authenticated users (editors) always get a freshly rendered page
+
+    Conditional GET
+    - the ETag of a public page is derived from the same version and known before rendering,
+      a revalidation only costs the lookup of the page
+    - there is no Last-Modified header: global content and navigations change the page without a date of their own
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from micromanager.cache import SharedVersion
+from micromanager.surrogate import get_surrogate_keys
+
+import hashlib
+
+PAGE_CACHE_ALIAS = getattr(settings, "MICROMANAGER_PAGE_CACHE", None)
+PAGE_CACHE_TIMEOUT = getattr(settings, "MICROMANAGER_PAGE_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+def get_page_cache():
+    if PAGE_CACHE_ALIAS is None:
+        return None
+    return caches[PAGE_CACHE_ALIAS]
+
+
+# global content (template_content is None) is shown on every page of a cms
+def global_content_version(cms_id):
+    return SharedVersion("global_content", cms_id)
+
+
+# navigations and listings: types, titles and slugs of listed template contents
+def navigation_version(cms_id):
+    return SharedVersion("navigation", cms_id)
+
+
+# previews and pages seen by editors differ from the published page
+def is_public_request(request):
+
+    if request.method not in ["GET", "HEAD"]:
+        return False
+
+    if "preview" in request.GET:
+        return False
+
+    if request.user.is_authenticated():
+        return False
+
+    return True
+
+
+def is_cacheable(request):
+    return get_page_cache() is not None and is_public_request(request)
+
+
+"""
+    the version of a public page, identifies its rendered output
+    - localized_template_content is None for pages which only consist of a base template (home, section home)
+"""
+def get_page_version(request, localized_template_content=None, section=None):
+    cms = request.cms
+
+    parts = [cms.pk, cms.theme, section, request.cms_language]
+
+    if localized_template_content is not None:
+        last_modified = localized_template_content.last_modified
+        if last_modified is not None:
+            last_modified = last_modified.strftime("%Y%m%d%H%M%S%f")
+
+        parts += [localized_template_content.pk, last_modified, localized_template_content.published_version,
+                  localized_template_content.template_content.published_version]
+
+    parts += [global_content_version(cms.pk).get(), navigation_version(cms.pk).get()]
+
+    return ":".join([str(part) for part in parts])
+
+
+def get_page_cache_key(request, localized_template_content=None, section=None):
+    return "micromanager:page:%s" % get_page_version(request, localized_template_content, section)
+
+
+def get_page_etag(request, localized_template_content=None, section=None):
+    version = get_page_version(request, localized_template_content, section)
+    return hashlib.md5(version.encode("utf-8")).hexdigest()
+
+
+def get_cached_page(cache_key):
+    return get_page_cache().get(cache_key)
+
+
+def cache_page(request, cache_key, response):
+
+    if response.status_code != 200 or response.streaming:
+        return
+
+    # pages setting cookies (e.g. a csrf token of a login form) are not shared between users
+    if response.cookies or request.META.get("CSRF_COOKIE_USED", False):
+        return
+
+    surrogate_keys = sorted(get_surrogate_keys(request))
+
+    get_page_cache().set(cache_key, (response.content, response["Content-Type"], surrogate_keys), PAGE_CACHE_TIMEOUT)
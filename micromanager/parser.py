@@ -2,92 +2,202 @@
     Parser for the Page Admin
     - receives a template
     - extracts all cms microcontent relevant tags into model objects for ModelForm
-    
+    - uses django's template Lexer, only block tokens are inspected
+    - follows {% include %} with literal template names, the cms tags of included templates belong to the page
+    - {% extends %} with a literal template name is only followed to watch the parent templates for changes:
+      their cms tags are global content (e.g. base.html) or belong to other templates, not to this page
+    - results are memoized per (theme, template_name) and reused as long as the source files are unmodified
 """
+from django.template import loader, TemplateDoesNotExist
+from django.template.base import Lexer
+
+try:
+    from django.template.base import TokenType
+    TOKEN_BLOCK = TokenType.BLOCK
+except ImportError:
+    from django.template.base import TOKEN_BLOCK
+
+import os, threading
 
 from micromanager.CMSObjects import CMSTag
+from micromanager.models import content_category_model_map
+from micromanager.middleware import get_current_theme
+
+FOLLOWED_TAGS = ["include", "extends"]
+
+
+def _unquote(bit):
+    if len(bit) >= 2 and bit[0] == bit[-1] and bit[0] in ["'", '"']:
+        return bit[1:-1]
+    return bit
+
+
+def _is_literal(bit):
+    return len(bit) >= 2 and bit[0] == bit[-1] and bit[0] in ["'", '"']
+
+
+def _get_source(template):
+    try:
+        # django 1.10
+        return template.source
+    except AttributeError:
+        # django 1.8
+        return template.origin.reload()
+
+
+def _get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+
+
+"""
+    create a CMSTag from the bits of a {% cms_* %} tag, e.g.
+    {% cms_get_microcontents 'multi_content' 'layoutable-simple' min=2 max=3 as contents %}
+"""
+def create_cms_tag(bits):
+
+    content_category = bits[0].split("_")[-1]
+
+    if content_category not in content_category_model_map or len(bits) < 2:
+        return None
+
+    tag_bits = bits[1:]
+
+    # {% ... as varname %}
+    if len(tag_bits) >= 2 and tag_bits[-2] == "as":
+        tag_bits = tag_bits[:-2]
+
+    content_type = _unquote(tag_bits.pop(0))
+
+    tag_args = []
+    tag_kwargs = {}
+
+    for bit in tag_bits:
+        arg = _unquote(bit)
+
+        if not _is_literal(bit) and "=" in bit:
+            key, value = bit.split("=", 1)
+            tag_kwargs[key] = _unquote(value)
+        elif arg.startswith("min-") or arg.startswith("max-"):
+            key, value = arg.split("-", 1)
+            tag_kwargs[key] = value
+        else:
+            tag_args.append(arg)
+
+    for key in ["min", "max"]:
+        if key in tag_kwargs:
+            try:
+                tag_kwargs[key] = int(tag_kwargs[key])
+            except ValueError:
+                del tag_kwargs[key]
+
+    return CMSTag(content_category, content_type, *tag_args, **tag_kwargs)
+
+
+class ParsedTemplate(object):
+
+    def __init__(self, cms_tags, dependencies):
+        self.cms_tags = cms_tags
+        # (path, mtime) of all source files that have been read
+        self.dependencies = dependencies
+
+    def is_fresh(self):
+        for path, mtime in self.dependencies:
+            if _get_mtime(path) != mtime:
+                return False
+        return True
+
 
 class TemplateParser(object):
 
+    _cache = {}
+    _lock = threading.Lock()
+
     def __init__(self, template):
         self.template = template
         self.cms_tags = []
+        self.dependencies = []
 
-    def parse(self):
-
-        cms_tags_str = []
+    def _cache_key(self):
+        origin = getattr(self.template, "origin", None)
+        template_name = getattr(origin, "template_name", None)
 
-        tag_open = False
+        if template_name is None:
+            return None
 
-        cms_tag_open = False
+        return (get_current_theme(), template_name)
 
-        obj_open = False
-        obj_buffer = ""
+    def parse(self):
 
-        try:
-            # django 1.10
-            source = self.template.source
-        except:
-            # django 1.8
-            source = self.template.origin.reload()
+        key = self._cache_key()
 
-        for char in source:
+        if key is not None:
+            parsed = self._cache.get(key, None)
+            if parsed is not None and parsed.is_fresh():
+                self.cms_tags = list(parsed.cms_tags)
+                self.dependencies = list(parsed.dependencies)
+                return self.cms_tags
 
-            if tag_open:
-                obj_buffer += char
-                if obj_buffer == "{% cms_":
-                    cms_tag_open = True
+        cms_tags = []
+        dependencies = []
+        self._parse_template(self.template, cms_tags, dependencies, set([]), set([]))
 
-                if char == "}":
+        if key is not None:
+            with self._lock:
+                self._cache[key] = ParsedTemplate(tuple(cms_tags), tuple(dependencies))
 
-                    if cms_tag_open:
-                        cms_tags_str.append(obj_buffer)
-                        
-                    cms_tag_open = False
-                    tag_open = False
-                    obj_open = False
+        self.cms_tags = cms_tags
+        self.dependencies = dependencies
+        return self.cms_tags
 
-                    obj_buffer = ""
-                continue
+    # collect is False for parent templates, only their source files are recorded
+    def _parse_template(self, template, cms_tags, dependencies, seen_tags, visited, collect=True):
 
-            elif obj_open:
-                obj_buffer += char
-                if obj_buffer == "{%":
-                    tag_open = True
+        origin = getattr(template, "origin", None)
+        path = getattr(origin, "name", None)
 
-                elif char == "}":
-                    obj_open = False
-                continue
+        if path is not None:
+            if path in visited:
+                return
+            visited.add(path)
+            dependencies.append((path, _get_mtime(path)))
 
-            elif char == "{":
-                obj_open = True
-                obj_buffer = char
-                continue
+        parents = []
 
-        for tag_str in cms_tags_str:
+        for token in Lexer(_get_source(template)).tokenize():
 
-            tag_content = tag_str.lstrip("{%").rstrip("%}").strip().split(" ")
+            if token.token_type != TOKEN_BLOCK:
+                continue
 
-            tag = tag_content.pop(0)
+            bits = token.split_contents()
 
-            tag_content = [t.strip("'") for t in tag_content]
+            if not bits:
+                continue
 
-            content_category = tag.split("_")[-1]
+            if bits[0].startswith("cms_"):
+                if not collect:
+                    continue
 
-            content_type = tag_content.pop(0)
+                tag = create_cms_tag(bits)
 
-            tag_kwargs = {}
+                if tag is not None and (tag.content_category, tag.content_type) not in seen_tags:
+                    seen_tags.add((tag.content_category, tag.content_type))
+                    cms_tags.append(tag)
 
-            # iterate ofer tag args and create kwargs if necessary
-            for arg in tag_content:
-                if arg.startswith("min-") or arg.startswith("max-"):
-                    parts = arg.split("-")
-                    tag_kwargs[parts[0]] = tag_kwargs[parts[1]]
-            
-            tagobj = CMSTag(content_category, content_type, *tag_content, **tag_kwargs)
+            elif bits[0] in FOLLOWED_TAGS and len(bits) > 1 and _is_literal(bits[1]):
+                template_name = _unquote(bits[1])
 
-            self.cms_tags.append(tagobj)
+                try:
+                    followed = loader.get_template(template_name).template
+                except TemplateDoesNotExist:
+                    continue
 
-        return self.cms_tags
+                if bits[0] == "extends":
+                    parents.append(followed)
+                else:
+                    self._parse_template(followed, cms_tags, dependencies, seen_tags, visited, collect)
 
-            
+        for parent in parents:
+            self._parse_template(parent, cms_tags, dependencies, seen_tags, visited, False)
@@ -0,0 +1,318 @@
+"""
+    Publishing pipeline
+    - publishes a TemplateContent and its locales in one transaction with a fixed number of queries:
+        validate         completeness of all languages, read from TranslationStatus
+        microcontent     UPDATE ... SET published_content = draft_content for all localized microcontents
+        images           copies draft images which have not been published yet
+        documents        PublishedContent documents of the published languages, read by the public site
+        locales          UPDATE of the published_version of the localized template contents
+        template_content published_version and published_at of the template content
+        signal           template_content_published
+    - the duration of every phase is reported in PublishResult.timings and logged
+
+    Batch publishing
+    - create_publish_batch() stores the template contents to publish as PublishBatch with one item each
+    - run_publish_batch() validates and publishes the pending items chunk by chunk and yields a
+      BatchProgress after every item
+    - each item is marked in the transaction which publishes it, an interrupted batch is resumed
+      by running it again
+
+    Scheduled publication
+    - TemplateContent.publish_at and unpublish_at are indexed, run_scheduled_publications() fetches the due
+      template contents with one query per field and publishes them as batch per cms
+    - the due rows are locked, the scheduled batch is created and publish_at is cleared in one transaction:
+      a due template content is either still due or item of a scheduled batch
+    - scheduled batches which have not finished (the scheduler has been interrupted) are resumed first,
+      failed publications are recorded in their batch and not retried
+    - unpublishing removes published_at and the published versions and sends template_content_unpublished,
+      its handlers invalidate listings and navigations and purge the page once the transaction is committed
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.translation import ugettext as _
+
+from micromanager.models import (TemplateContent, LocalizedTemplateContent, LocalizedMicroContent, ContentImages,
+                                 PublishBatch, PublishBatchItem)
+from micromanager.completeness import (get_incomplete_languages_stored, get_incomplete_languages,
+                                       translation_status_changed)
+from micromanager.content import write_published_content, delete_published_content
+
+from collections import OrderedDict
+import logging, time, json
+
+logger = logging.getLogger(__name__)
+
+
+class PublishResult(object):
+
+    def __init__(self, template_content):
+        self.template_content = template_content
+        self.errors = []
+        self.timings = OrderedDict()
+        self._phase_started_at = None
+
+    @property
+    def published(self):
+        return not self.errors
+
+    def start_phase(self):
+        self._phase_started_at = time.time()
+
+    def end_phase(self, phase):
+        self.timings[phase] = time.time() - self._phase_started_at
+
+
+def _incomplete_message():
+    return _("The texts of this content or its translations (if any) are not yet complete.")
+
+
+def publish_template_content(template_content, language="all", validate=True):
+
+    result = PublishResult(template_content)
+
+    with transaction.atomic():
+
+        result.start_phase()
+        # lock the row, concurrent publications of the same template content are serialized
+        template_content = TemplateContent.objects.select_for_update().get(pk=template_content.pk)
+        localized_template_contents = list(LocalizedTemplateContent.objects.filter(template_content=template_content))
+
+        if validate and get_incomplete_languages(template_content, localized_template_contents):
+            result.errors.append(_incomplete_message())
+        result.end_phase("validate")
+
+        # below this, no error checks are allowed because published_versions are being set
+        if result.errors:
+            return result
+
+        if language != "all":
+            localized_template_contents = [ltc for ltc in localized_template_contents if ltc.language == language]
+            if not localized_template_contents:
+                raise LocalizedTemplateContent.DoesNotExist("No %s version of %s" % (language, template_content.pk))
+
+        languages = [ltc.language for ltc in localized_template_contents]
+
+        result.start_phase()
+        LocalizedMicroContent.objects.filter(microcontent__template_content=template_content,
+                                             language__in=languages).update(published_content=F("draft_content"))
+        result.end_phase("microcontent")
+
+        result.start_phase()
+        for content_image in ContentImages.objects.filter(template_content=template_content):
+            if not content_image.published_content:
+                content_image.publish(language)
+        result.end_phase("images")
+
+        result.start_phase()
+        write_published_content(template_content.cms, template_content, languages)
+        result.end_phase("documents")
+
+        result.start_phase()
+        LocalizedTemplateContent.objects.filter(pk__in=[ltc.pk for ltc in localized_template_contents]).update(
+            published_version=template_content.draft_version, last_modified=timezone.now())
+        result.end_phase("locales")
+
+        result.start_phase()
+        template_content.save(publish=True)
+        result.end_phase("template_content")
+
+        result.start_phase()
+        from micromanager.signals import template_content_published
+        template_content_published.send(sender=TemplateContent, template_content=template_content, language=language)
+        result.end_phase("signal")
+
+    result.template_content = template_content
+
+    logger.info("published template content %s: %s" % (template_content.pk, ", ".join(
+        ["%s %.1fms" % (phase, duration * 1000) for phase, duration in result.timings.items()])))
+
+    return result
+
+
+DEFAULT_CHUNK_SIZE = 50
+
+
+class BatchProgress(object):
+
+    def __init__(self, batch, item, errors):
+        self.batch = batch
+        self.item = item
+        self.template_content_id = item.template_content_id
+        self.errors = errors
+        self.done = batch.published_count + batch.failed_count
+        self.total = batch.total
+        self.published = batch.published_count
+        self.failed = batch.failed_count
+
+    def __str__(self):
+        status = "published" if not self.errors else "failed: %s" % " ".join(self.errors)
+        return "[%s/%s] %s %s" % (self.done, self.total, self.template_content_id, status)
+
+
+"""
+    template_contents is a queryset or a list of TemplateContent ids
+"""
+def create_publish_batch(cms, template_contents, language="all", user=None, scheduled=False):
+
+    if hasattr(template_contents, "values_list"):
+        template_content_ids = list(template_contents.filter(cms=cms).order_by("pk").values_list("pk", flat=True))
+    else:
+        template_content_ids = list(TemplateContent.objects.filter(cms=cms, pk__in=list(template_contents)).order_by(
+                                        "pk").values_list("pk", flat=True))
+
+    with transaction.atomic():
+        batch = PublishBatch.objects.create(cms=cms, language=language, created_by=user,
+                                            total=len(template_content_ids), scheduled=scheduled)
+
+        PublishBatchItem.objects.bulk_create([
+            PublishBatchItem(batch=batch, template_content_id=template_content_id, position=position)
+            for position, template_content_id in enumerate(template_content_ids)
+        ])
+
+    return batch
+
+
+def _finish_item(batch, item, errors):
+    item.status = "failed" if errors else "published"
+    item.errors = json.dumps(errors) if errors else None
+    item.save(update_fields=["status", "errors"])
+
+    if errors:
+        batch.failed_count += 1
+        PublishBatch.objects.filter(pk=batch.pk).update(failed_count=F("failed_count") + 1)
+    else:
+        batch.published_count += 1
+        PublishBatch.objects.filter(pk=batch.pk).update(published_count=F("published_count") + 1)
+
+
+# returns None if the item has already been handled by another process resuming the batch
+def _publish_item(batch, item, template_content, incomplete_languages):
+
+    with transaction.atomic():
+
+        if not PublishBatchItem.objects.select_for_update().filter(pk=item.pk, status="pending").exists():
+            return None
+
+        if template_content is None:
+            errors = [_("The content does not exist anymore.")]
+
+        elif incomplete_languages:
+            errors = [_incomplete_message()]
+
+        else:
+            try:
+                # validated in bulk for the whole chunk
+                errors = publish_template_content(template_content, language=batch.language, validate=False).errors
+            except Exception as e:
+                errors = [str(e)]
+
+        _finish_item(batch, item, errors)
+
+    return errors
+
+
+def run_publish_batch(batch, chunk_size=DEFAULT_CHUNK_SIZE):
+
+    PublishBatch.objects.filter(pk=batch.pk).update(status="running")
+    batch.status = "running"
+
+    # counters are recomputed, the batch may have been interrupted between two updates
+    batch.published_count = batch.publishbatchitem_set.filter(status="published").count()
+    batch.failed_count = batch.publishbatchitem_set.filter(status="failed").count()
+    PublishBatch.objects.filter(pk=batch.pk).update(published_count=batch.published_count,
+                                                    failed_count=batch.failed_count)
+
+    while True:
+        items = list(batch.publishbatchitem_set.filter(status="pending").order_by("position")[:chunk_size])
+
+        if not items:
+            break
+
+        template_contents = dict((tc.pk, tc) for tc in TemplateContent.objects.filter(
+                                    pk__in=[item.template_content_id for item in items]).select_related("cms"))
+
+        incomplete = get_incomplete_languages_stored(batch.cms, template_contents.values())
+
+        for item in items:
+            template_content = template_contents.get(item.template_content_id, None)
+            errors = _publish_item(batch, item, template_content, incomplete.get(item.template_content_id, None))
+            if errors is not None:
+                yield BatchProgress(batch, item, errors)
+
+    batch.status = "finished"
+    batch.finished_at = timezone.now()
+    PublishBatch.objects.filter(pk=batch.pk).update(status=batch.status, finished_at=batch.finished_at)
+
+
+def publish_batch(cms, template_contents, language="all", user=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    batch = create_publish_batch(cms, template_contents, language=language, user=user)
+    return batch, run_publish_batch(batch, chunk_size=chunk_size)
+
+
+def unpublish_template_content(template_content):
+
+    with transaction.atomic():
+        template_content = TemplateContent.objects.select_for_update().get(pk=template_content.pk)
+
+        LocalizedTemplateContent.objects.filter(template_content=template_content).update(
+            published_version=None, last_modified=timezone.now())
+
+        # update() leaves draft_version alone, save() would start a new version
+        TemplateContent.objects.filter(pk=template_content.pk).update(published_version=None, published_at=None,
+                                                                      unpublish_at=None)
+        template_content.published_version = None
+        template_content.published_at = None
+        template_content.unpublish_at = None
+
+        # update() sends no post_save
+        translation_status_changed(template_content.pk)
+
+        delete_published_content(template_content)
+
+        from micromanager.signals import template_content_unpublished
+        template_content_unpublished.send(sender=TemplateContent, template_content=template_content)
+
+    logger.info("unpublished template content %s" % template_content.pk)
+
+    return template_content
+
+
+"""
+    publishes and unpublishes all template contents whose publish_at or unpublish_at is due,
+    yields BatchProgress for publications and the unpublished template contents
+"""
+def run_scheduled_publications(now=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    from micromanager.models import CMS
+
+    if now is None:
+        now = timezone.now()
+
+    # batches of an interrupted run
+    for batch in PublishBatch.objects.filter(scheduled=True).exclude(status="finished").select_related(
+                    "cms").order_by("pk"):
+        for progress in run_publish_batch(batch, chunk_size=chunk_size):
+            yield progress
+
+    cms_ids = TemplateContent.objects.filter(publish_at__lte=now).values_list("cms_id", flat=True).distinct()
+
+    for cms in CMS.objects.filter(pk__in=list(cms_ids)).order_by("pk"):
+
+        with transaction.atomic():
+            # a concurrent scheduler waits here and finds nothing due anymore
+            template_content_ids = list(TemplateContent.objects.select_for_update().filter(cms=cms,
+                                        publish_at__lte=now).order_by("pk").values_list("pk", flat=True))
+
+            if not template_content_ids:
+                continue
+
+            batch = create_publish_batch(cms, template_content_ids, scheduled=True)
+
+            # cleared with the creation of the batch, a failing publication is not retried on every run
+            TemplateContent.objects.filter(pk__in=template_content_ids).update(publish_at=None)
+
+        for progress in run_publish_batch(batch, chunk_size=chunk_size):
+            yield progress
+
+    for template_content in TemplateContent.objects.filter(unpublish_at__lte=now).order_by("pk"):
+        yield unpublish_template_content(template_content)
@@ -0,0 +1,113 @@
+"""
+    Purger backends
+    - remove responses tagged with surrogate keys from a caching reverse proxy or CDN
+    - configured with MICROMANAGER_PURGER (dotted path, default: None = no purging) and
+      MICROMANAGER_PURGER_OPTIONS (dict passed to the backend)
+    - example for varnish with xkey:
+        MICROMANAGER_PURGER = 'micromanager.purgers.HTTPPurger'
+        MICROMANAGER_PURGER_OPTIONS = {
+            'urls' : ['http://127.0.0.1:6081/'],
+            'header' : 'xkey-purge',
+        }
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+import logging, threading
+
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+
+class BasePurger(object):
+
+    def __init__(self, **options):
+        self.options = options
+
+    def purge(self, keys):
+        raise NotImplementedError("Purgers need a purge method")
+
+
+"""
+    sends one request per url, the keys are space separated in a header
+    - options: urls, method (default: PURGE), header (default: Surrogate-Key), timeout, max_keys
+"""
+class HTTPPurger(BasePurger):
+
+    def __init__(self, **options):
+        super(HTTPPurger, self).__init__(**options)
+        self.urls = options.get("urls", [])
+        self.method = options.get("method", "PURGE")
+        self.header = options.get("header", "Surrogate-Key")
+        self.timeout = options.get("timeout", 5)
+        # proxies limit the length of header lines
+        self.max_keys = options.get("max_keys", 100)
+
+    def _send(self, url, keys):
+        request = Request(url, headers={self.header : " ".join(keys)})
+        request.get_method = lambda: self.method
+        response = urlopen(request, timeout=self.timeout)
+        response.close()
+
+    def purge(self, keys):
+        keys = sorted(keys)
+
+        for url in self.urls:
+            for start in range(0, len(keys), self.max_keys):
+                try:
+                    self._send(url, keys[start:start + self.max_keys])
+                except Exception as e:
+                    logger.error("purging %s failed: %s" % (url, e))
+
+
+"""
+    keeps purged keys in memory, e.g. for tests
+"""
+class MemoryPurger(BasePurger):
+
+    purged = []
+    _lock = threading.Lock()
+
+    def purge(self, keys):
+        with self._lock:
+            self.purged.append(sorted(keys))
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            del cls.purged[:]
+
+
+"""
+    appends one line of space separated keys per purge to a file
+    - options: path
+"""
+class FilePurger(BasePurger):
+
+    _lock = threading.Lock()
+
+    def purge(self, keys):
+        with self._lock:
+            with open(self.options["path"], "a") as f:
+                f.write(" ".join(sorted(keys)) + "\n")
+
+
+_purger = None
+
+def get_purger():
+    global _purger
+
+    purger_path = getattr(settings, "MICROMANAGER_PURGER", None)
+
+    if purger_path is None:
+        return None
+
+    if _purger is None:
+        Purger = import_string(purger_path)
+        _purger = Purger(**getattr(settings, "MICROMANAGER_PURGER_OPTIONS", {}))
+
+    return _purger
@@ -0,0 +1,231 @@
+"""
+    signal handlers keeping the micromanager caches in sync with the database
+    connected in MicroManagerConfig.ready()
+"""
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal
+from django.contrib.auth import get_user_model
+
+from micromanager.models import (CMS, CMSLanguages, CMSDomain, TemplateContent, LocalizedTemplateContent,
+                                 TemplateContentTypes, MicroContent, LocalizedMicroContent, ContentImages)
+from micromanager.cache import resolution_cache, SharedVersion, get_global_content_cache
+from micromanager.pagecache import global_content_version, navigation_version
+from micromanager.surrogate import (purge, global_slot_key, content_type_key, template_key,
+                                    get_template_content_keys)
+from micromanager.content import invalidate_global_published_content
+
+"""
+    sent by TemplateContent.publish() after the template content and its locales have been published
+"""
+template_content_published = Signal(providing_args=["template_content", "language"])
+
+"""
+    sent by micromanager.publishing.unpublish_template_content() after the template content has been taken offline
+"""
+template_content_unpublished = Signal(providing_args=["template_content"])
+
+
+def invalidate_resolution_cache(sender, **kwargs):
+    resolution_cache.version.bump_on_commit()
+
+
+def invalidate_resolution_cache_on_user_change(sender, **kwargs):
+    # logging in only touches last_login, which does not affect the setup state
+    update_fields = kwargs.get("update_fields", None)
+    if update_fields is not None and set(update_fields) == set(["last_login"]):
+        return
+    resolution_cache.version.bump_on_commit()
+
+
+def _get_cms_id(instance):
+    if isinstance(instance, TemplateContent):
+        return instance.cms_id
+
+    try:
+        return instance.template_content.cms_id
+    except TemplateContent.DoesNotExist:
+        return None
+
+
+def invalidate_listing_cache(sender, instance, **kwargs):
+    cms_id = _get_cms_id(instance)
+    if cms_id is not None:
+        SharedVersion("listing", cms_id).bump_on_commit()
+
+
+# unpublishing uses update(), no post_save is sent
+def invalidate_listing_cache_on_unpublish(sender, template_content, **kwargs):
+    SharedVersion("listing", template_content.cms_id).bump_on_commit()
+
+
+# listed template contents appear in navigations or listings on other pages
+def _is_listed(template_content):
+    if template_content.template_type == "content":
+        return True
+    return TemplateContentTypes.objects.filter(template_content=template_content).exists()
+
+
+def invalidate_navigation(sender, instance, **kwargs):
+    if isinstance(instance, TemplateContentTypes) or kwargs.get("signal", None) == post_delete:
+        cms_id = _get_cms_id(instance)
+        if cms_id is not None:
+            navigation_version(cms_id).bump_on_commit()
+        return
+
+    # LocalizedTemplateContent: title or slug may have changed
+    try:
+        template_content = instance.template_content
+    except TemplateContent.DoesNotExist:
+        return
+
+    if _is_listed(template_content):
+        navigation_version(template_content.cms_id).bump_on_commit()
+
+
+def invalidate_navigation_on_publish(sender, template_content, **kwargs):
+    if _is_listed(template_content):
+        navigation_version(template_content.cms_id).bump_on_commit()
+
+
+# the global MicroContent or ContentImages of instance, None if instance is content of a page
+def get_global_microcontent(instance):
+    microcontent = instance
+
+    if isinstance(instance, LocalizedMicroContent):
+        try:
+            microcontent = instance.microcontent
+        except MicroContent.DoesNotExist:
+            return None
+
+    if microcontent.template_content_id is None and microcontent.cms_id is not None:
+        return microcontent
+
+    return None
+
+
+# the surrogate keys of the navigations and listings a change of instance appears in
+def get_navigation_keys(instance, **kwargs):
+    if isinstance(instance, TemplateContentTypes):
+        cms_id = _get_cms_id(instance)
+        if cms_id is None:
+            return []
+        return [content_type_key(cms_id, instance.content_type)]
+
+    if isinstance(instance, TemplateContent):
+        return [template_key(instance.cms_id, instance.template_name)]
+
+    try:
+        template_content = instance.template_content
+    except TemplateContent.DoesNotExist:
+        return []
+
+    if _is_listed(template_content) or kwargs.get("signal", None) == post_delete:
+        return get_template_content_keys(template_content)
+
+    return []
+
+
+def invalidate_global_content(sender, instance, **kwargs):
+    microcontent = get_global_microcontent(instance)
+
+    if microcontent is not None:
+        global_content_version(microcontent.cms_id).bump_on_commit()
+        invalidate_global_published_content(microcontent.cms_id)
+        # a DatabaseVersion, the new version becomes visible together with the content
+        get_global_content_cache(microcontent.cms_id).version.bump()
+        purge([global_slot_key(microcontent.cms_id, microcontent.content_type)])
+
+
+def purge_template_content(sender, template_content, **kwargs):
+    purge(get_template_content_keys(template_content))
+
+
+# translation status, see micromanager.completeness
+def update_translation_status(sender, instance, **kwargs):
+    from micromanager.completeness import translation_status_changed
+
+    if isinstance(instance, TemplateContent):
+        # the status rows of a deleted template content are deleted with its locales
+        if kwargs.get("signal", None) != post_delete:
+            translation_status_changed(instance.pk)
+        return
+
+    if isinstance(instance, LocalizedMicroContent):
+        template_content_id = MicroContent.objects.filter(pk=instance.microcontent_id).values_list(
+                                "template_content_id", flat=True).first()
+    else:
+        template_content_id = instance.template_content_id
+
+    if template_content_id is not None:
+        translation_status_changed(template_content_id)
+
+
+def connect_signals():
+
+    for Model in [CMS, CMSLanguages, CMSDomain]:
+        post_save.connect(invalidate_resolution_cache, sender=Model,
+                          dispatch_uid="micromanager_resolution_%s_save" % Model.__name__)
+        post_delete.connect(invalidate_resolution_cache, sender=Model,
+                            dispatch_uid="micromanager_resolution_%s_delete" % Model.__name__)
+
+    User = get_user_model()
+    post_save.connect(invalidate_resolution_cache_on_user_change, sender=User,
+                      dispatch_uid="micromanager_resolution_user_save")
+    post_delete.connect(invalidate_resolution_cache_on_user_change, sender=User,
+                        dispatch_uid="micromanager_resolution_user_delete")
+
+    for Model in [TemplateContent, LocalizedTemplateContent, TemplateContentTypes]:
+        post_save.connect(invalidate_listing_cache, sender=Model,
+                          dispatch_uid="micromanager_listing_%s_save" % Model.__name__)
+        post_delete.connect(invalidate_listing_cache, sender=Model,
+                            dispatch_uid="micromanager_listing_%s_delete" % Model.__name__)
+
+    for Model in [LocalizedTemplateContent, TemplateContentTypes]:
+        post_save.connect(invalidate_navigation, sender=Model,
+                          dispatch_uid="micromanager_navigation_%s_save" % Model.__name__)
+    for Model in [TemplateContent, LocalizedTemplateContent, TemplateContentTypes]:
+        post_delete.connect(invalidate_navigation, sender=Model,
+                            dispatch_uid="micromanager_navigation_%s_delete" % Model.__name__)
+    template_content_published.connect(invalidate_navigation_on_publish,
+                                       dispatch_uid="micromanager_navigation_publish")
+    template_content_published.connect(purge_template_content,
+                                       dispatch_uid="micromanager_purge_publish")
+    template_content_unpublished.connect(invalidate_listing_cache_on_unpublish,
+                                         dispatch_uid="micromanager_listing_unpublish")
+    template_content_unpublished.connect(invalidate_navigation_on_publish,
+                                         dispatch_uid="micromanager_navigation_unpublish")
+    template_content_unpublished.connect(purge_template_content,
+                                         dispatch_uid="micromanager_purge_unpublish")
+
+    # re-render static pages, see micromanager.export
+    if getattr(settings, "MICROMANAGER_EXPORT_ON_PUBLISH", False) == True:
+        from micromanager.export import regenerate_on_publish
+        template_content_published.connect(regenerate_on_publish, dispatch_uid="micromanager_export_publish")
+        template_content_unpublished.connect(regenerate_on_publish, dispatch_uid="micromanager_export_unpublish")
+
+        from micromanager.export import regenerate_on_global_content_change, regenerate_on_navigation_change
+        for Model in [MicroContent, LocalizedMicroContent, ContentImages]:
+            post_save.connect(regenerate_on_global_content_change, sender=Model,
+                              dispatch_uid="micromanager_export_global_content_%s_save" % Model.__name__)
+            post_delete.connect(regenerate_on_global_content_change, sender=Model,
+                                dispatch_uid="micromanager_export_global_content_%s_delete" % Model.__name__)
+
+        for Model in [LocalizedTemplateContent, TemplateContentTypes]:
+            post_save.connect(regenerate_on_navigation_change, sender=Model,
+                              dispatch_uid="micromanager_export_navigation_%s_save" % Model.__name__)
+        for Model in [TemplateContent, LocalizedTemplateContent, TemplateContentTypes]:
+            post_delete.connect(regenerate_on_navigation_change, sender=Model,
+                                dispatch_uid="micromanager_export_navigation_%s_delete" % Model.__name__)
+
+    for Model in [TemplateContent, LocalizedTemplateContent, MicroContent, LocalizedMicroContent, ContentImages]:
+        post_save.connect(update_translation_status, sender=Model,
+                          dispatch_uid="micromanager_translation_status_%s_save" % Model.__name__)
+        post_delete.connect(update_translation_status, sender=Model,
+                            dispatch_uid="micromanager_translation_status_%s_delete" % Model.__name__)
+
+    for Model in [MicroContent, LocalizedMicroContent, ContentImages]:
+        post_save.connect(invalidate_global_content, sender=Model,
+                          dispatch_uid="micromanager_global_content_%s_save" % Model.__name__)
+        post_delete.connect(invalidate_global_content, sender=Model,
+                            dispatch_uid="micromanager_global_content_%s_delete" % Model.__name__)
@@ -0,0 +1,93 @@
+"""
+    Surrogate keys
+    - public responses are tagged with the keys of everything they show, in the Surrogate-Key header:
+        cms-<cms_id>                        every page of the cms
+        page-<template_content_id>          the page itself and template contents rendered with include_content
+        type-<cms_id>-<content_type>        listings of get_content_by_type, e.g. navigations
+        template-<cms_id>-<template_name>   listings of get_template_content
+        global-<cms_id>                     global content
+        global-<cms_id>-<content_type>      a global content slot
+    - the keys are collected on the request while rendering and written by MicroManagerMiddleware
+    - publishing a template content purges its page key and the keys of the listings it appears in,
+      changing global content purges the key of its slot, see micromanager.purgers
+    - every page reading a global slot is tagged with its key, also if the slot is empty or
+      filled by the page: global content created later is shown on it
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils.text import slugify
+
+from micromanager.purgers import get_purger
+
+SURROGATE_KEY_HEADER = getattr(settings, "MICROMANAGER_SURROGATE_KEY_HEADER", "Surrogate-Key")
+
+
+def cms_key(cms_id):
+    return "cms-%s" % cms_id
+
+
+def page_key(template_content_id):
+    return "page-%s" % template_content_id
+
+
+def content_type_key(cms_id, content_type):
+    return "type-%s-%s" % (cms_id, slugify(content_type))
+
+
+def template_key(cms_id, template_name):
+    return "template-%s-%s" % (cms_id, slugify(template_name.replace("/", "-").replace(".", "-")))
+
+
+def global_key(cms_id):
+    return "global-%s" % cms_id
+
+
+def global_slot_key(cms_id, content_type):
+    return "global-%s-%s" % (cms_id, slugify(content_type))
+
+
+def add_surrogate_keys(request, *keys):
+    surrogate_keys = getattr(request, "micromanager_surrogate_keys", None)
+
+    if surrogate_keys is None:
+        surrogate_keys = set([])
+        request.micromanager_surrogate_keys = surrogate_keys
+
+    surrogate_keys.update(keys)
+
+
+def get_surrogate_keys(request):
+    return getattr(request, "micromanager_surrogate_keys", set([]))
+
+
+def set_surrogate_key_header(response, keys):
+    if keys:
+        response[SURROGATE_KEY_HEADER] = " ".join(sorted(keys))
+
+
+# the keys of all responses showing the template content
+def get_template_content_keys(template_content):
+    keys = [page_key(template_content.pk), template_key(template_content.cms_id, template_content.template_name)]
+
+    for content_type in template_content.types():
+        keys.append(content_type_key(template_content.cms_id, content_type))
+
+    return keys
+
+
+# purged after the transaction has been committed, a proxy must not fetch the old version again
+# if MICROMANAGER_JOB_QUEUE is True, a worker purges the keys, requests do not wait for the proxy
+def purge(keys):
+    from micromanager.jobs import JOB_QUEUE, enqueue
+
+    purger = get_purger()
+
+    if purger is None or not keys:
+        return
+
+    keys = sorted(set(keys))
+
+    if JOB_QUEUE == True:
+        transaction.on_commit(lambda: enqueue("purge_keys", keys=keys))
+    else:
+        transaction.on_commit(lambda: purger.purge(set(keys)))
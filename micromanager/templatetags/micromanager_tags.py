@@ -6,6 +6,9 @@ from django.template import loader, Context
 
 from micromanager.models import (TemplateContent, LocalizedTemplateContent, MicroContent, ContentImages, content_category_model_map,
                               TemplateContentTypes)
+from micromanager.content import get_content_bundle, list_content_by_type, list_template_content
+from micromanager.surrogate import (add_surrogate_keys, page_key, content_type_key, template_key, global_key,
+                                    global_slot_key)
 
 from django.db.models import Q
 
@@ -20,27 +23,17 @@ def get_content_by_type(context, content_type, *args, **kwargs):
     limit = kwargs.get('limit', None)
 
     preview = "preview" in context["request"].GET
-    template_content_ids = TemplateContentTypes.objects.filter(template_content__cms=cms, content_type=content_type,
-                                                               template_content__published_at__isnull=preview).order_by("position").values_list("template_content_id", flat=True)
 
-    if limit is not None:
-        template_content_ids = template_content_ids[:limit]
+    add_surrogate_keys(context["request"], content_type_key(cms.pk, content_type))
 
-    template_content_ids = list(template_content_ids)
-    # does not preserve order
-    localized_tcs = LocalizedTemplateContent.objects.filter(template_content_id__in=template_content_ids, language=language)
-
-    localized_tcs = list(localized_tcs)
-    localized_tcs.sort(key=lambda localized_tc: template_content_ids.index(localized_tc.template_content.id))
-
-    return localized_tcs
+    return list_content_by_type(cms, content_type, language, preview=preview, limit=limit)
 
 """
     returns all pages of a given type
 """
 @register.assignment_tag
 def get_template_content_locale(template_content, language):
-    return LocalizedTemplateContent.objects.filter(template_content=template_content, language=language).first()
+    return template_content.get_localized(language)
 
 """
     fetch_by_template_name
@@ -52,20 +45,10 @@ def get_template_content(context, template_name, *args, **kwargs):
     limit = kwargs.get('limit', None)
 
     preview = "preview" in context["request"].GET
-    template_content_ids = TemplateContent.objects.filter(cms=cms, template_name=template_name,
-                                                          published_at__isnull=preview).order_by("-published_at").values_list("id", flat=True)
-
-    if limit is not None:
-        template_content_ids = template_content_ids[:limit]
 
-    template_content_ids = list(template_content_ids)
-    # does not preserve order
-    localized_tcs = LocalizedTemplateContent.objects.filter(template_content_id__in=template_content_ids, language=language)
+    add_surrogate_keys(context["request"], template_key(cms.pk, template_name))
 
-    localized_tcs = list(localized_tcs)
-    localized_tcs.sort(key=lambda localized_tc: template_content_ids.index(localized_tc.template_content.id))
-
-    return localized_tcs
+    return list_template_content(cms, template_name, language, preview=preview, limit=limit)
 
 """
     common tag for microcontent(images and html)
@@ -89,6 +72,7 @@ def cms_getall(context, content_category, content_type, *args, **kwargs):
     returns a single micro content
     does not support template_content
     needs "template_content" in context
+    the content of the page is read from the request's ContentBundle
 """
 # helper
 def cms_get(context, content_category, content_type, *args, **kwargs):
@@ -99,10 +83,17 @@ def cms_get(context, content_category, content_type, *args, **kwargs):
     
     Model = content_category_model_map[content_category]
 
-    microcontent = Model.objects.filter(Q(template_content=template_content, content_type=content_type) | Q(template_content__isnull=True, content_type=content_type)).first()
+    bundle = get_content_bundle(context["request"], template_content, context["request"].cms_language)
+
+    microcontent = bundle.get_instance(Model, content_type)
+
+    # the slot may be filled by global content created later
+    if not microcontent or microcontent.template_content_id == None:
+        cms_id = context["request"].cms.pk
+        add_surrogate_keys(context["request"], global_key(cms_id), global_slot_key(cms_id, content_type))
         
     if microcontent:
-        if microcontent.template_content == None:
+        if microcontent.template_content_id == None:
             preview = True
         microcontent = microcontent.get_content(context["request"].cms_language, preview)
 
@@ -118,7 +109,9 @@ def cms_get_multiple(context, content_category, content_type, *args, **kwargs):
     template_content = context['template_content']
 
     Model = content_category_model_map[content_category]
-    instances = Model.objects.filter(template_content=template_content, content_type=content_type)
+
+    bundle = get_content_bundle(context["request"], template_content, context["request"].cms_language)
+    instances = bundle.get_instances(Model, content_type)
 
     content = []
 
@@ -159,13 +152,7 @@ def cms_get_images(context, content_type, *args, **kwargs):
 
 @register.filter
 def template_content_translation_complete(template_content, language):
-    ltc = template_content.get_localized(language)
-
-    if not ltc:
-        return False
-
-    else:
-        return ltc.translation_complete()
+    return template_content.translation_complete(language)
 
 
 @register.assignment_tag(takes_context=True)
@@ -200,7 +187,8 @@ def include_latest_content(context, template_name):
     t = loader.get_template(template_name)
 
     # create the correct context
-    template_content = TemplateContent.objects.filter(template_name=template_name).last()
+    template_content = TemplateContent.objects.filter(cms=context['request'].cms, template_name=template_name).last()
+    add_surrogate_keys(context['request'], template_key(context['request'].cms.pk, template_name))
     template_context = Context({
         'request': context['request'],
         'template_content': template_content,
@@ -212,6 +200,7 @@ def include_latest_content(context, template_name):
 @register.simple_tag(takes_context=True)
 def include_content(context, localized_template_content):
     t = loader.get_template(localized_template_content.template_content.template_name)
+    add_surrogate_keys(context['request'], page_key(localized_template_content.template_content_id))
 
     # create the correct context
     template_context = Context({
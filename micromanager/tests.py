@@ -1,3 +1,400 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from django.utils import timezone
 
-# Create your tests here.
+from micromanager.models import (CMS, CMSLanguages, TemplateContent, LocalizedTemplateContent, TemplateContentTypes,
+                                 MicroContent, PublishBatch, TranslationStatus)
+from micromanager.cache import get_cache, resolution_cache
+from micromanager.content import list_content_by_type
+from micromanager.pagecache import navigation_version, global_content_version
+from micromanager.checks import check_cache
+from micromanager.publishing import publish_template_content, unpublish_template_content, run_scheduled_publications
+from micromanager import purgers
+from micromanager.surrogate import global_slot_key, page_key
+from micromanager.export import export_cms, regenerate_keys
+from micromanager.completeness import get_slot_counts_bulk
+from micromanager.manifest import ThemeManifest, get_manifest, get_changed_templates, manifest_rebuilt
+
+import os, shutil, tempfile, datetime, copy
+
+
+"""
+    helpers
+    - caches live in the process and in MICROMANAGER_CACHE, they are reset for every test
+    - invalidation happens in transaction.on_commit, tests checking it are TransactionTestCases
+"""
+class MicroManagerTestMixin(object):
+
+    def setUp(self):
+        super(MicroManagerTestMixin, self).setUp()
+
+        get_cache().clear()
+        resolution_cache.clear()
+
+        User = get_user_model()
+        self.user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.cms = CMS.objects.create("Test", "observatory", "en")
+
+    def create_page(self, cms, title):
+        template_content = TemplateContent.objects.create(self.user, cms, title, "pages/free_page.html", "page")
+        return LocalizedTemplateContent.objects.get(template_content=template_content)
+
+
+"""
+    resolution cache (user-001)
+"""
+class ResolutionCacheTest(MicroManagerTestMixin, TransactionTestCase):
+
+    def test_language_change_reloads_language_set(self):
+        cms = resolution_cache.get("cms", lambda: CMS.objects.all().first())
+        self.assertEqual(cms.language_set(), (("en", True),))
+
+        CMSLanguages.objects.create(cms=self.cms, language="de")
+
+        self.assertEqual(sorted(cms.language_set()), [("de", False), ("en", True)])
+
+    def test_version_is_bumped_after_commit(self):
+        version = resolution_cache.version.get()
+
+        with transaction.atomic():
+            self.cms.name = "Renamed"
+            self.cms.save()
+            # other processes must not reload before the change is visible to them
+            self.assertEqual(resolution_cache.version.get(), version)
+
+        self.assertNotEqual(resolution_cache.version.get(), version)
+        self.assertEqual(resolution_cache.get("cms", lambda: CMS.objects.all().first()).name, "Renamed")
+
+    def test_rolled_back_change_keeps_version(self):
+        version = resolution_cache.version.get()
+
+        try:
+            with transaction.atomic():
+                self.cms.save()
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(resolution_cache.version.get(), version)
+
+
+class CacheCheckTest(TestCase):
+
+    @override_settings(CACHES={"default" : {"BACKEND" : "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_process_local_cache_warns(self):
+        self.assertEqual([message.id for message in check_cache(None)], ["micromanager.W001"])
+
+    @override_settings(CACHES={"default" : {"BACKEND" : "django.core.cache.backends.dummy.DummyCache"}})
+    def test_dummy_cache_is_an_error(self):
+        self.assertEqual([message.id for message in check_cache(None)], ["micromanager.E002"])
+
+    @override_settings(CACHES={"default" : {"BACKEND" : "django.core.cache.backends.filebased.FileBasedCache",
+                                            "LOCATION" : "/tmp/micromanager-test-cache"}})
+    def test_shared_cache_passes(self):
+        self.assertEqual(check_cache(None), [])
+
+
+"""
+    slugs are unique per cms and language (user-002, user-022)
+"""
+class SlugTest(MicroManagerTestMixin, TestCase):
+
+    def test_slugs_are_unique_within_a_cms(self):
+        self.assertEqual(self.create_page(self.cms, "Impressum").slug, "impressum")
+        self.assertEqual(self.create_page(self.cms, "Impressum").slug, "impressum2")
+        self.assertEqual(self.create_page(self.cms, "Impressum").slug, "impressum3")
+
+    def test_tenants_do_not_share_slugs(self):
+        other_cms = CMS.objects.create("Other", "observatory", "en")
+
+        self.assertEqual(self.create_page(self.cms, "Impressum").slug, "impressum")
+        self.assertEqual(self.create_page(other_cms, "Impressum").slug, "impressum")
+
+    def test_languages_do_not_share_slugs(self):
+        CMSLanguages.objects.create(cms=self.cms, language="de")
+        ltc = self.create_page(self.cms, "Impressum")
+
+        translation = LocalizedTemplateContent.objects.create(self.user, ltc.template_content, "de", "Impressum")
+
+        self.assertEqual(translation.slug, "impressum")
+        self.assertEqual(translation.cms_id, self.cms.pk)
+
+
+"""
+    listing cache (user-009)
+"""
+class ListingCacheTest(MicroManagerTestMixin, TransactionTestCase):
+
+    def create_listed_page(self, title, position):
+        ltc = self.create_page(self.cms, title)
+        TemplateContentTypes.objects.create(template_content=ltc.template_content, content_type="Navigation",
+                                            position=position)
+        return ltc
+
+    def list_titles(self):
+        return [ltc.title for ltc in list_content_by_type(self.cms, "Navigation", "en")]
+
+    def test_listing_follows_publications(self):
+        impressum = self.create_listed_page("Impressum", 2)
+        contact = self.create_listed_page("Contact", 1)
+        self.assertEqual(self.list_titles(), [])
+
+        publish_template_content(impressum.template_content, validate=False)
+        publish_template_content(contact.template_content, validate=False)
+        self.assertEqual(self.list_titles(), ["Contact", "Impressum"])
+
+        unpublish_template_content(contact.template_content)
+        self.assertEqual(self.list_titles(), ["Impressum"])
+
+    def test_title_change_is_listed(self):
+        ltc = self.create_listed_page("Impressum", 1)
+        publish_template_content(ltc.template_content, validate=False)
+        self.assertEqual(self.list_titles(), ["Impressum"])
+
+        ltc = LocalizedTemplateContent.objects.get(pk=ltc.pk)
+        ltc.title = "Legal notice"
+        ltc.save()
+
+        self.assertEqual(self.list_titles(), ["Legal notice"])
+
+
+"""
+    versions of the page cache (user-010)
+"""
+class PageCacheVersionTest(MicroManagerTestMixin, TransactionTestCase):
+
+    def test_navigation_version_is_bumped_after_commit(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        version = navigation_version(self.cms.pk).get()
+
+        with transaction.atomic():
+            TemplateContentTypes.objects.create(template_content=ltc.template_content, content_type="Navigation")
+            self.assertEqual(navigation_version(self.cms.pk).get(), version)
+
+        self.assertNotEqual(navigation_version(self.cms.pk).get(), version)
+
+    def test_global_content_version_is_bumped_after_commit(self):
+        version = global_content_version(self.cms.pk).get()
+
+        with transaction.atomic():
+            MicroContent.objects.create(None, "en", "footer", "footer", self.user, cms=self.cms)
+            self.assertEqual(global_content_version(self.cms.pk).get(), version)
+
+        self.assertNotEqual(global_content_version(self.cms.pk).get(), version)
+
+    def test_page_content_is_not_bumped(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        version = global_content_version(self.cms.pk).get()
+
+        MicroContent.objects.create(ltc.template_content, "en", "freepage_content", "text", self.user)
+
+        self.assertEqual(global_content_version(self.cms.pk).get(), version)
+
+    def test_navigation_change_renders_a_new_page(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        publish_template_content(ltc.template_content, validate=False)
+        etag = self.client.get("/pages/impressum/")["ETag"]
+
+        TemplateContentTypes.objects.create(template_content=ltc.template_content, content_type="Navigation")
+
+        response = self.client.get("/pages/impressum/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('href="/pages/impressum/"', response.content.decode("utf-8"))
+
+"""
+    conditional GET (user-011)
+    - global content changes the page without changing its template content
+"""
+class ConditionalGetTest(MicroManagerTestMixin, TransactionTestCase):
+
+    def test_global_content_change_is_not_modified(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        publish_template_content(ltc.template_content, validate=False)
+        footer = MicroContent.objects.create(None, "en", "footer", "old footer", self.user, cms=self.cms)
+
+        response = self.client.get("/pages/impressum/")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Last-Modified"))
+        etag = response["ETag"]
+
+        response = self.client.get("/pages/impressum/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        footer.set_content("new footer", self.user, "en")
+
+        response = self.client.get("/pages/impressum/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get("/pages/impressum/", HTTP_IF_MODIFIED_SINCE="Sun, 01 Jan 2090 00:00:00 GMT")
+        self.assertEqual(response.status_code, 200)
+
+
+"""
+    surrogate keys of global content (user-012)
+"""
+@override_settings(MICROMANAGER_PURGER="micromanager.purgers.MemoryPurger")
+class GlobalContentPurgeTest(MicroManagerTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(GlobalContentPurgeTest, self).setUp()
+        # the purger is created once per process
+        purgers._purger = None
+        purgers.MemoryPurger.clear()
+
+    def tearDown(self):
+        purgers._purger = None
+        super(GlobalContentPurgeTest, self).tearDown()
+
+    def test_empty_slot_is_tagged_and_purged(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        publish_template_content(ltc.template_content, validate=False)
+        slot_key = global_slot_key(self.cms.pk, "freepage_content")
+
+        response = self.client.get("/pages/impressum/")
+        self.assertIn(slot_key, response["Surrogate-Key"].split(" "))
+
+        MicroContent.objects.create(None, "en", "freepage_content", "global text", self.user, cms=self.cms)
+
+        self.assertIn([slot_key], purgers.MemoryPurger.purged)
+
+
+"""
+    static export (user-013, user-014)
+"""
+@override_settings(ALLOWED_HOSTS=["testserver"])
+class ExportRegenerationTest(MicroManagerTestMixin, TransactionTestCase):
+
+    def setUp(self):
+        super(ExportRegenerationTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        super(ExportRegenerationTest, self).tearDown()
+
+    def read_page(self, slug):
+        with open(os.path.join(self.root, "pages", slug, "index.html"), "r") as f:
+            return f.read()
+
+    def test_section_pages_are_exported(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        TemplateContentTypes.objects.create(template_content=ltc.template_content, content_type="Blog")
+        publish_template_content(ltc.template_content, validate=False)
+
+        manifest, errors = export_cms(self.root, self.cms)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(manifest["pages"]["section/Blog/impressum/index.html"]["url"], "/section/Blog/impressum/")
+        self.assertIn("pages/impressum/index.html", manifest["pages"])
+
+    def test_global_content_regenerates_pages_reading_the_slot(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        publish_template_content(ltc.template_content, validate=False)
+        manifest, errors = export_cms(self.root, self.cms)
+        self.assertEqual(errors, [])
+        self.assertNotIn("global text", self.read_page("impressum"))
+
+        MicroContent.objects.create(None, "en", "freepage_content", "global text", self.user, cms=self.cms)
+
+        self.assertEqual(regenerate_keys(self.root, [global_slot_key(self.cms.pk, "freepage_content")]), [])
+        self.assertIn("global text", self.read_page("impressum"))
+
+    def test_deleted_pages_are_removed(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        publish_template_content(ltc.template_content, validate=False)
+        export_cms(self.root, self.cms)
+        template_content_id = ltc.template_content_id
+
+        ltc.template_content.delete()
+
+        self.assertEqual(regenerate_keys(self.root, [page_key(template_content_id)]), [])
+        self.assertFalse(os.path.exists(os.path.join(self.root, "pages", "impressum", "index.html")))
+
+
+"""
+    scheduled publication (user-019)
+"""
+class ScheduledPublicationTest(MicroManagerTestMixin, TestCase):
+
+    def schedule_pages(self, *titles):
+        publish_at = timezone.now() - datetime.timedelta(minutes=1)
+
+        template_contents = [self.create_page(self.cms, title).template_content for title in titles]
+        TemplateContent.objects.filter(pk__in=[tc.pk for tc in template_contents]).update(publish_at=publish_at)
+
+        return template_contents
+
+    def test_interrupted_run_is_resumed(self):
+        self.schedule_pages("Impressum", "Contact")
+
+        # the scheduler dies after the first page
+        progress = run_scheduled_publications()
+        next(progress)
+        progress.close()
+
+        batch = PublishBatch.objects.get()
+        self.assertTrue(batch.scheduled)
+        self.assertEqual(batch.publishbatchitem_set.filter(status="pending").count(), 1)
+        self.assertFalse(TemplateContent.objects.filter(publish_at__isnull=False).exists())
+
+        self.assertEqual(len(list(run_scheduled_publications())), 1)
+
+        batch = PublishBatch.objects.get()
+        self.assertEqual(batch.status, "finished")
+        self.assertFalse(batch.publishbatchitem_set.filter(status="pending").exists())
+
+    def test_finished_batches_are_not_run_again(self):
+        self.schedule_pages("Impressum")
+
+        self.assertEqual(len(list(run_scheduled_publications())), 1)
+        self.assertEqual(list(run_scheduled_publications()), [])
+
+
+"""
+    translation completeness (user-020, user-021)
+"""
+class CompletenessTest(MicroManagerTestMixin, TestCase):
+
+    def get_status(self, ltc):
+        return TranslationStatus.objects.get(localized_template_content=ltc)
+
+    def test_slot_counts_bulk(self):
+        filled = self.create_page(self.cms, "Impressum").template_content
+        empty = self.create_page(self.cms, "Contact").template_content
+        MicroContent.objects.create(filled, "en", "freepage_content", "text", self.user)
+
+        slot_counts = get_slot_counts_bulk(self.cms, [filled, empty])
+
+        self.assertEqual(slot_counts[filled.pk], (1, {"en" : 1}))
+        self.assertEqual(slot_counts[empty.pk], (1, {"en" : 0}))
+
+    def test_status_is_maintained_on_write(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        ltc.translation_ready = True
+        ltc.save()
+
+        self.assertFalse(self.get_status(ltc).complete)
+        self.assertNotEqual(publish_template_content(ltc.template_content).errors, [])
+
+        MicroContent.objects.create(ltc.template_content, "en", "freepage_content", "text", self.user)
+
+        status = self.get_status(ltc)
+        self.assertEqual((status.slots_required, status.slots_filled), (1, 1))
+        self.assertTrue(status.complete)
+        self.assertEqual(publish_template_content(ltc.template_content).errors, [])
+
+    def test_manifest_rebuild_recomputes_status(self):
+        ltc = self.create_page(self.cms, "Impressum")
+        manifest = get_manifest(self.cms.theme)
+        self.assertEqual(get_changed_templates(manifest, manifest), [])
+
+        # the template had no slots when the status was computed
+        TranslationStatus.objects.filter(localized_template_content=ltc).update(slots_required=0)
+        previous = ThemeManifest(copy.deepcopy(manifest.data))
+        previous.data["slots"]["pages/free_page.html"] = []
+
+        self.assertEqual(get_changed_templates(previous, manifest), ["pages/free_page.html"])
+        manifest_rebuilt(self.cms.theme, previous, manifest)
+
+        self.assertEqual(self.get_status(ltc).slots_required, 1)
@@ -0,0 +1,186 @@
+"""
+    ThemeRegistry
+    - discovers themes lazily: a theme is a direct subfolder of one of the theme dirs containing a settings.json
+    - theme dirs are MICROMANAGER_THEME_DIRS (optional) followed by micromanager/themes
+    - parses the settings.json of each theme once and keeps the result in memory
+    - the parsed settings are immutable: dicts become read-only mappings, lists become tuples
+    - in debug mode settings.json and the theme dirs are stat'ed at most every
+      MICROMANAGER_THEME_RELOAD_INTERVAL seconds and reread if they changed, in production they are never checked again
+"""
+from django.conf import settings
+
+import os, json, threading, time
+
+from types import MappingProxyType
+
+DEFAULT_RELOAD_INTERVAL = 2 if settings.DEBUG else None
+RELOAD_INTERVAL = getattr(settings, "MICROMANAGER_THEME_RELOAD_INTERVAL", DEFAULT_RELOAD_INTERVAL)
+
+
+def _get_themes_root():
+    micromanagerpath = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(micromanagerpath, "themes")
+
+
+def get_theme_dirs():
+    theme_dirs = list(getattr(settings, "MICROMANAGER_THEME_DIRS", []))
+    theme_dirs.append(_get_themes_root())
+    return theme_dirs
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType(dict((key, _freeze(v)) for key, v in value.items()))
+    elif isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class ThemeSettingsEntry(object):
+
+    def __init__(self, theme_settings, mtime, checked_at):
+        self.settings = theme_settings
+        self.mtime = mtime
+        self.checked_at = checked_at
+
+
+class ThemeIndex(object):
+
+    def __init__(self, paths, checked_at):
+        self.paths = paths
+        self.checked_at = checked_at
+
+
+class ThemeRegistry(object):
+
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self._index = None
+        self._settings = {}
+        self._lock = threading.Lock()
+
+    # only the first level of each theme dir is listed, the contents of themes are never walked
+    def _build_index(self):
+        paths = {}
+
+        for theme_dir in get_theme_dirs():
+
+            if not os.path.isdir(theme_dir):
+                continue
+
+            for theme_name in sorted(os.listdir(theme_dir)):
+                theme_path = os.path.join(theme_dir, theme_name)
+                # the first theme dir containing a theme wins
+                if theme_name not in paths and os.path.isfile(os.path.join(theme_path, "settings.json")):
+                    paths[theme_name] = theme_path
+
+        return ThemeIndex(paths, time.time())
+
+    def _get_index(self):
+        index = self._index
+
+        if index is None or (self.reload_interval is not None and time.time() - index.checked_at >= self.reload_interval):
+            with self._lock:
+                index = self._build_index()
+                self._index = index
+
+        return index
+
+    def get_theme_names(self):
+        return sorted(self._get_index().paths.keys())
+
+    # (theme_name, verbose_name) tuples for choices
+    def get_installed_themes(self):
+        themes = []
+        for theme_name in self.get_theme_names():
+            themes.append((theme_name, self.get_settings(theme_name)["name"]))
+        return themes
+
+    def get_theme_path(self, theme_name):
+        theme_path = self._get_index().paths.get(theme_name, None)
+
+        if theme_path is None:
+            # not installed, return where it would be expected
+            theme_path = os.path.join(_get_themes_root(), theme_name)
+
+        return theme_path
+
+    def get_settings_path(self, theme_name):
+        return os.path.join(self.get_theme_path(theme_name), "settings.json")
+
+    def _load(self, theme_name):
+        settings_path = self.get_settings_path(theme_name)
+
+        try:
+            mtime = os.path.getmtime(settings_path)
+        except OSError:
+            raise FileNotFoundError("settings file for theme %s could not be found." % theme_name)
+
+        with open(settings_path, "r") as f:
+            theme_settings = _freeze(json.load(f))
+
+        return ThemeSettingsEntry(theme_settings, mtime, time.time())
+
+    def _is_fresh(self, entry, theme_name):
+
+        if self.reload_interval is None:
+            return True
+
+        now = time.time()
+        if now - entry.checked_at < self.reload_interval:
+            return True
+
+        try:
+            mtime = os.path.getmtime(self.get_settings_path(theme_name))
+        except OSError:
+            return False
+
+        if mtime == entry.mtime:
+            entry.checked_at = now
+            return True
+
+        return False
+
+    def get_settings(self, theme_name):
+        entry = self._settings.get(theme_name, None)
+
+        if entry is None or not self._is_fresh(entry, theme_name):
+            with self._lock:
+                entry = self._load(theme_name)
+                self._settings[theme_name] = entry
+
+        return entry.settings
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+            self._settings = {}
+
+
+theme_registry = ThemeRegistry()
+
+
+def get_installed_themes():
+    return theme_registry.get_installed_themes()
+
+
+"""
+    choices for model fields which are only resolved when they are iterated
+    the theme dirs are not touched when models.py is imported
+"""
+class LazyThemeChoices(object):
+
+    def __iter__(self):
+        return iter(get_installed_themes())
+
+    def __len__(self):
+        return len(get_installed_themes())
+
+    def __getitem__(self, index):
+        return get_installed_themes()[index]
+
+    # django checks choices for truthiness when the field is created
+    def __bool__(self):
+        return True
+
+    __nonzero__ = __bool__
@@ -26,6 +26,8 @@ urlpatterns = [
         name='micromanager_manage_template_content'),
     url(r'^cms-admin/publish-content/(?P<template_content_id>[\d]+)/$',
         login_required(views.PublishTemplateContent.as_view()), name='micromanager_publish_template_content'),
+    url(r'^cms-admin/job/(?P<job_id>[\d]+)/$', login_required(views.JobStatus.as_view()),
+        name='micromanager_job_status'),
     # list template_content by template_type: 'pages' or 'content'
     url(r'^cms-admin/content/(?P<template_type>[\w]+)/$', login_required(views.TemplateContentList.as_view()),
         name='micromanager_list_template_content'),
@@ -4,7 +4,10 @@ from .compatibility import reverse
 from django.views.generic.edit import FormView
 from django.views.generic import DetailView, TemplateView, ListView
 from django.utils.translation import ugettext as _
-from django.http import Http404
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import condition
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
 
 import os, json
 
@@ -14,10 +17,18 @@ from micromanager.forms import (CreateTemplateContentForm, ManageTemplateContent
                                 ManagePagebaseForm, ManageMicroContentsForm, TranslatePageForm, FirstTimeSetupForm,
                                 CreateAdminForm)
 
-from micromanager.models import TemplateContent, LocalizedTemplateContent, TemplateContentTypes, content_category_model_map, CMS, CMSLanguages
+from micromanager.models import TemplateContent, LocalizedTemplateContent, TemplateContentTypes, content_category_model_map, CMS, CMSLanguages, CMSDomain, Job
+
+from micromanager.middleware import MULTI_TENANCY, get_cms_for_domain, get_request_domain
 
 from micromanager.mixins import AdminOnlyMixin
 
+from micromanager.pagecache import (is_public_request, is_cacheable, get_page_cache_key, get_cached_page, cache_page,
+                                    get_page_etag)
+from micromanager.surrogate import add_surrogate_keys, page_key
+from micromanager.jobs import enqueue
+from micromanager.completeness import prefetch_translation_status, defer_translation_status
+
 from micromanager.CMSObjects import CMSTag, Theme
 
 from django.template import loader
@@ -37,11 +48,23 @@ class GenericPageView(DetailView):
     def get_object(self, queryset=None):
 
         if "pk" in self.kwargs:
-            template_content = TemplateContent.objects.get(pk=self.kwargs["pk"])
+            template_content = TemplateContent.objects.filter(cms=self.request.cms, pk=self.kwargs["pk"]).first()
+            if not template_content:
+                raise Http404("TemplateContent not found")
             localized_template_content = LocalizedTemplateContent.objects.filter(template_content=template_content,
-                                                        language=template_content.cms.get_language()).first()
+                                                        language=self.request.cms_language).first()
         else:
-            localized_template_content = LocalizedTemplateContent.objects.filter(slug=self.kwargs["slug"]).first()
+            # slugs are unique per language, the same slug may be used by several languages
+            localized_template_contents = list(LocalizedTemplateContent.objects.filter(cms=self.request.cms,
+                                                slug=self.kwargs["slug"]).select_related("template_content").order_by("pk"))
+            localized_template_content = None
+            for ltc in localized_template_contents:
+                if ltc.language == self.request.cms_language:
+                    localized_template_content = ltc
+                    break
+
+            if localized_template_content is None and localized_template_contents:
+                localized_template_content = localized_template_contents[0]
 
         if not localized_template_content:
             raise Http404("TemplateContent not found")
@@ -55,6 +78,41 @@ class GenericPageView(DetailView):
 
             return localized_template_content
 
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+
+        section = self.kwargs.get("section", None)
+
+        def render_page(request):
+            cache_key = None
+
+            if is_cacheable(request):
+                cache_key = get_page_cache_key(request, self.object, section=section)
+                cached = get_cached_page(cache_key)
+
+                if cached is not None:
+                    content, content_type, surrogate_keys = cached
+                    add_surrogate_keys(request, *surrogate_keys)
+                    return HttpResponse(content, content_type=content_type)
+
+            add_surrogate_keys(request, page_key(self.object.template_content_id))
+
+            context = self.get_context_data(object=self.object)
+            response = self.render_to_response(context)
+
+            if cache_key is not None:
+                response.add_post_render_callback(lambda response: cache_page(request, cache_key, response))
+
+            return response
+
+        if not is_public_request(request):
+            return render_page(request)
+
+        # conditional GET, answered before anything is rendered
+        etag = get_page_etag(request, self.object, section=section)
+
+        return condition(etag_func=lambda request: etag)(render_page)(request)
+
     def get_context_data(self, **kwargs):
         context = super(GenericPageView, self).get_context_data(**kwargs)
 
@@ -66,9 +124,9 @@ class GenericPageView(DetailView):
         context["base_template"] = "base.html"
 
         # sections may use different base templates
-        if "section" in kwargs:
-            section = kwargs["section"]
-            settings = request.cms.load_theme_settings()
+        if "section" in self.kwargs:
+            section = self.kwargs["section"]
+            settings = self.request.cms.load_theme_settings()
             context["base_template"] = settings["sections"][section]["extends"]
         
         return context
@@ -89,7 +147,12 @@ class GenericSectionHomeView(TemplateView):
         settings = request.cms.load_theme_settings()
         self.template_name = settings["sections"][section]["extends"]
 
-        return self.render_to_response({})
+        if not is_public_request(request):
+            return self.render_to_response({})
+
+        etag = get_page_etag(request, section=section)
+
+        return condition(etag_func=lambda request: etag)(lambda request: self.render_to_response({}))(request)
     
 
 # this always extends the Main section base template
@@ -102,7 +165,7 @@ class GenericHomePageView(TemplateView):
         preview = self.request.GET.get("preview",False)
 
         # check if there is an assigned home template_content
-        hp = TemplateContent.objects.filter(is_home_page=True, published_version__isnull=preview).first()
+        hp = TemplateContent.objects.filter(cms=request.cms, is_home_page=True, published_version__isnull=preview).first()
 
         if hp and (preview or hp.published_at != None):
 
@@ -115,8 +178,13 @@ class GenericHomePageView(TemplateView):
                     response['Location'] += '?preview=1'
                     
                 return response
-        
-        return self.render_to_response({})
+
+        if not is_public_request(request):
+            return self.render_to_response({})
+
+        etag = get_page_etag(request)
+
+        return condition(etag_func=lambda request: etag)(lambda request: self.render_to_response({}))(request)
 
 
 """
@@ -199,6 +267,7 @@ class ManageMicroContents(AdminOnlyMixin, TemplateView):
                     field.cms_object.content_type,
                     content,
                     user,
+                    cms=self.request.cms,
                 )
 
             # a multifield cant have ONE instance
@@ -262,7 +331,9 @@ class ManageMicroContents(AdminOnlyMixin, TemplateView):
         form = self.get_post_form(request.POST)
 
         if form.is_valid():
-            self.form_valid(form)
+            # the translation status is updated once for all saved fields
+            with transaction.atomic(), defer_translation_status():
+                self.form_valid(form)
 
             # necessary but not nice
             form = self.get_form()
@@ -283,7 +354,7 @@ class ManageTemplateContent(ManageMicroContents):
 
     def dispatch(self, request, *args, **kwargs):
         
-        template_content = TemplateContent.objects.get(pk=kwargs["pk"])
+        template_content = TemplateContent.objects.get(cms=request.cms, pk=kwargs["pk"])
 
         language = kwargs.get("language", request.cms.primary_language())
 
@@ -349,6 +420,13 @@ class ManageTemplateContent(ManageMicroContents):
         # save the microcontent
         self.save_cms_fields(form)
 
+        # the schedule is no content, saving the template content would start a new version
+        # saved last, saving microcontent also saves (other instances of) the template content
+        self.template_content.publish_at = form.cleaned_data.get("publish_at", None)
+        self.template_content.unpublish_at = form.cleaned_data.get("unpublish_at", None)
+        TemplateContent.objects.filter(pk=self.template_content.pk).update(
+            publish_at=self.template_content.publish_at, unpublish_at=self.template_content.unpublish_at)
+
 
     def get_initial(self):
 
@@ -359,6 +437,8 @@ class ManageTemplateContent(ManageMicroContents):
             "language" : self.localized_template_content.language,
             "is_home_page" : is_home_page,
             "page_types" : self.localized_template_content.types(),
+            "publish_at" : self.localized_template_content.template_content.publish_at,
+            "unpublish_at" : self.localized_template_content.template_content.unpublish_at,
         }
         return initial
 
@@ -378,7 +458,7 @@ class TranslateTemplateContent(ManageMicroContents):
     form_class = TranslatePageForm
 
     def dispatch(self, request, *args, **kwargs):
-        template_content = TemplateContent.objects.get(pk=kwargs["pk"])
+        template_content = TemplateContent.objects.get(cms=request.cms, pk=kwargs["pk"])
         kwargs["template_content"] = template_content
 
         self.language = kwargs["language"]
@@ -429,16 +509,35 @@ class PublishTemplateContent(TemplateView):
 
     def dispatch(self, request, *args, **kwargs):
 
-        self.template_content = TemplateContent.objects.get(pk=kwargs["template_content_id"])
+        self.template_content = TemplateContent.objects.get(cms=request.cms, pk=kwargs["template_content_id"])
         self.language = kwargs.get("language", "all")
 
         return super(PublishTemplateContent, self).dispatch(request, *args, **kwargs)
 
+    # publishing is a job, ?job=<id> renders the entry once the job is done
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
-        context["template_content"] = self.template_content
-        context["publication"] = True
-        context["publication_errors"] = self.template_content.publish(language=self.language)    
+
+        if "job" in request.GET:
+            job_id = request.GET["job"]
+            job = None
+            if job_id.isdigit():
+                job = Job.objects.filter(pk=job_id, cms=request.cms, kind="publish_template_content").first()
+
+            if job is None:
+                raise Http404("Job not found")
+        else:
+            job = enqueue("publish_template_content", cms=request.cms, user=request.user,
+                          template_content_id=self.template_content.pk, language=self.language)
+
+        if job.done:
+            self.template_content.refresh_from_db()
+
+        context["template_content"] = prefetch_translation_status(request.cms, [self.template_content])[0]
+        context["cms_languages"] = list(request.cms.languages())
+        context["job"] = job
+        context["publication"] = job.done
+        context["publication_errors"] = job.get_result().get("errors", [])
 
         return self.render_to_response(context)
             
@@ -493,7 +592,7 @@ class ManageNavigations(AdminOnlyMixin, TemplateView):
 
             for counter, template_content_id in enumerate(order, start=1):
 
-                naventry = TemplateContentTypes.objects.get(content_type=nav_type,
+                naventry = TemplateContentTypes.objects.get(template_content__cms=request.cms, content_type=nav_type,
                                                             template_content_id=template_content_id)
                 naventry.position = counter
                 naventry.save()
@@ -509,7 +608,8 @@ class ManageNavigations(AdminOnlyMixin, TemplateView):
         }
         
         for nav_class in theme.settings["navigations"]:
-            pages = TemplateContentTypes.objects.filter(content_type=nav_class).order_by("position")
+            pages = TemplateContentTypes.objects.filter(template_content__cms=request.cms,
+                                                        content_type=nav_class).order_by("position")
             sortables[nav_class] = pages
 
         context["navigations"] = sortables
@@ -524,8 +624,16 @@ class TemplateContentList(AdminOnlyMixin, ListView):
     
     model = TemplateContent
 
+    # locales and translation status of all listed template contents are loaded with a few queries
     def get_queryset(self):
-        return TemplateContent.objects.filter(cms=self.request.cms, template_type=self.kwargs['template_type'])
+        template_contents = TemplateContent.objects.filter(cms=self.request.cms,
+                                                           template_type=self.kwargs['template_type']).select_related("cms")
+        return prefetch_translation_status(self.request.cms, template_contents)
+
+    def get_context_data(self, **kwargs):
+        context = super(TemplateContentList, self).get_context_data(**kwargs)
+        context["cms_languages"] = list(self.request.cms.languages())
+        return context
 
 
 class DeleteTemplateContent(AdminOnlyMixin, TemplateView):
@@ -537,12 +645,12 @@ class DeleteTemplateContent(AdminOnlyMixin, TemplateView):
     def post(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
 
-        template_content = TemplateContent.objects.filter(pk=kwargs["template_content_id"]).first()
+        template_content = TemplateContent.objects.filter(cms=request.cms, pk=kwargs["template_content_id"]).first()
 
         if template_content:
-            template_content.delete()
+            context["job"] = enqueue("delete_template_content", cms=request.cms, user=request.user,
+                                     template_content_id=template_content.pk)
 
-            
         context.update(kwargs)
         context["success"] = True
 
@@ -552,6 +660,28 @@ class DeleteTemplateContent(AdminOnlyMixin, TemplateView):
         return self.render_to_response(kwargs)
 
 
+"""
+    status of a job, polled by the admin
+"""
+class JobStatus(AdminOnlyMixin, TemplateView):
+
+    def get(self, request, *args, **kwargs):
+        job = Job.objects.filter(pk=kwargs["job_id"], cms=request.cms).first()
+
+        if job is None:
+            raise Http404("Job not found")
+
+        data = {
+            "id" : job.pk,
+            "kind" : job.kind,
+            "status" : job.status,
+            "done" : job.done,
+            "result" : job.get_result(),
+        }
+
+        return HttpResponse(json.dumps(data), content_type="application/json")
+
+
 """
     this deletes Textarea or TextInput fields, including CKEditor
     ajax is not used
@@ -694,7 +824,8 @@ class UploadFile(AdminOnlyMixin, TemplateView):
                 instance.set_content(file, request.user, language)
 
             else:
-                instance = Model.objects.create(template_content, language, content_type, file, request.user)
+                instance = Model.objects.create(template_content, language, content_type, file, request.user,
+                                                cms=request.cms)
 
             field = cms_tag._create_field(language, instance, widget_attrs=widget_attrs)
 
@@ -805,14 +936,26 @@ class FirstTimeSetup(FormView):
     form_class = FirstTimeSetupForm
 
     def dispatch(self, request, *args, **kwargs):
-        if CMS.objects.all().exists():
+        if MULTI_TENANCY == True:
+            if get_cms_for_domain(get_request_domain(request)):
+                return redirect(reverse('micromanager_home'))
+
+            # additional tenants may only be created by a superuser
+            if CMS.objects.all().exists() and not request.user.is_superuser:
+                raise PermissionDenied
+
+        elif CMS.objects.all().exists():
             return redirect(reverse('micromanager_home'))
+
         return super(FirstTimeSetup, self).dispatch(request, *args, **kwargs)
 
     def form_valid(self, form):
         cms = CMS.objects.create(form.cleaned_data['cms_name'], form.cleaned_data['theme'],
                                  form.cleaned_data['primary_language'])
 
+        if MULTI_TENANCY == True:
+            CMSDomain.objects.create(domain=get_request_domain(self.request), cms=cms)
+
         return redirect(reverse('micromanager_home'))
 
 class CreateAdminAccount(FormView):